@@ -2,16 +2,74 @@
 Hexcells Solver
 
 Usage:
-  hexcells.py [--debug=LEVEL] [--show-moves] HEXCELLS_FILES...
+  hexcells.py benchmark [options] [HEXCELLS_FILES...]
+  hexcells.py pack ARCHIVE HEXCELLS_FILES...
+  hexcells.py hint [options] HEXCELLS_FILES...
+  hexcells.py generate [options] OUTPUT
+  hexcells.py [options] HEXCELLS_FILES...
+
+HEXCELLS_FILES can hold any number of levels one after another, and can be
+gzipped (*.hexcells.gz), zipped (*.zip), *.hxb archives made by pack, or
+directories of any of those.
+benchmark defaults to the solved and unsolved levels that come with the solver.
+pack writes all the levels to ARCHIVE in the compact *.hxb format.
+hint shows just the next moves for each level and the cells they follow from.
+generate writes random hexagonal levels to OUTPUT. They need --exhaustive to
+solve, each is checked by a fresh exhaustive solver searching as soon as the
+arithmetic stalls (stall_pairs=0).
 
 Options:
-  -h --help        Show this screen.
-  --debug=LEVEL    Debug print level [default: 10]
-  --show-moves     Show moves made during solving (synonym for --debug=15)
+  -h --help          Show this screen.
+  --debug=LEVEL      Debug print level [default: 10]
+  --show-moves       Show moves made during solving (synonym for --debug=15)
+  --plain            Draw boards without colors, listing the highlighted cells
+  --frames=FILE      Write the boards to FILE instead of stdout, to look back at
+  --incremental      Update the constraints after each move instead of rebuilding them
+  --scheduled        Try the most promising constraint pairs first instead of
+                     sweeping each rule in turn
+  --batched          Play every move a pass finds together instead of starting
+                     again after the first
+  --exhaustive       Search for moves exactly, component by component, when the
+                     constraint arithmetic stalls
+  --sat              Search for moves exactly with the SAT backend when the
+                     constraint arithmetic stalls, uses pycosat if installed
+  --check            Prove every move with the SAT backend before playing it
+  --probe            Try both colors of each constrained cell and play the other
+                     one when a color leads to a contradiction, when all else stalls
+  --probe-depth=N    Batches of moves to follow each probe for [default: 20]
+  --probe-jobs=N     Run the probes across N processes, not with --jobs
+  --prune            Leave derived constraints out when others already say as
+                     much, not with --incremental
+  --max-constraints=N  Keep at most N constraints, dropping the weakest derived
+                     ones, not with --scheduled
+  --pair-jobs=N      Share the constraint arithmetic of big passes out among N
+                     processes, not with --jobs
+  --numpy            Keep constraint patterns in numpy arrays (needs numpy)
+  --stats            Print per phase solver statistics for each level
+  --results=FILE     Keep solves in this SQLite file and replay them when the
+                     same level comes up again with the same options
+  --cache=N          Cache up to N constraint pair derivations, shared by all the
+                     levels solved in a process
+  --jobs=N           Batch mode, solve the levels across N processes and report
+                     a json line per level instead of stopping at the first failure
+  --report=FILE      Write the batch report to FILE instead of stdout
+  --timeout=SECONDS  Give up on a level after this long in batch, benchmark,
+                     hint and generate modes, benchmark and hint default to 60
+  --radius=N         Cells from the centre to the edge of generated levels [default: 4]
+  --count=N          Levels to generate [default: 1]
+  --seed=N           Seed for the random choices generate makes
+  --warmup=N         Untimed benchmark runs per level [default: 1]
+  --repeat=N         Timed benchmark runs per level [default: 3]
+  --baseline=FILE    Compare the benchmark against a saved baseline
+  --save-baseline=FILE  Save the benchmark results as a baseline
+  --tolerance=PCT    Slowdown against the baseline allowed before it counts
+                     as a regression, slowdowns under 50ms never count
+                     [default: 10]
 """
 
 from __future__ import unicode_literals
 from __future__ import division
+from __future__ import print_function
 
 """
 Level credits
@@ -21,19 +79,40 @@ cookie-the_star - This one necessitated advanced_arithmetic
 darman-tutorial_12 - Took a lot of rewriting and all the pattern stuff to get this going
 """
 
+# only what solving needs is imported here, the rest is imported where it's
+# used so starting a new interpreter to solve a level stays quick
 from collections import defaultdict
-import random
+import binascii
+import functools
+import heapq
+import os
+import struct
 import time
 import itertools
 import sys
 
-import docopt
-from cached_property import cached_property
-from colorama import init, Back
-init()
+# see load_numpy
+numpy = None
+
+# see load_pycosat, False until it's been looked for
+pycosat = False
 
 DEBUG = 0
 
+# keep constraint patterns in numpy arrays rather than lists of tuples
+NUMPY = False
+
+# APART lines with more arrangements than this aren't listed, see LazyPatterns
+PATTERN_LIMIT = 256
+
+# incremental solvers start again from the level once derived constraints
+# outnumber its own this many times over, pairing them all up again after
+# every move costs more than deriving them afresh
+REBUILD_FACTOR = 4
+
+# bump this when a change to the solver changes the moves it makes, it throws away saved results
+SOLVER_VERSION = 1
+
 # colors
 EMPTY, BLACK, BLUE, UNKNOWN = range(1, 5)
 
@@ -43,85 +122,241 @@ BASIC, AREA, VERTICAL, LEFT_DIAG, RIGHT_DIAG = range(1, 6)
 # modifiers
 TOGETHER, APART = range(1, 3)
 
+_back = None
+
+
+def terminal_colors():
+    """ colorama's Back, only imported once something gets dumped so solving doesn't need it """
+    global _back
+    if _back is None:
+        from colorama import init, Back
+        # the wrapped stdout strips the colors out again when it's a pipe or a file
+        init()
+        _back = Back
+    return _back
+
+
 def colored(text, color):
     if color:
-        return color + text + Back.RESET
+        return color + text + terminal_colors().RESET
     else:
         return text
 
 
+class cached_property(object):
+    """ a property worked out the first time it's used and then kept on the instance """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
+
+
 def add(a, b):
     return a[0] + b[0], a[1] + b[1]
 
 
+# cell sets are bitmasks with one bit per grid position
+def cell_bit(c):
+    return 1 << (c[1] * 33 + c[0])
+
+
+def cells_mask(cells):
+    mask = 0
+    for c in cells:
+        mask |= cell_bit(c)
+    return mask
+
+
+def mask_cells(mask):
+    cells = []
+    while mask:
+        low = mask & -mask
+        i = low.bit_length() - 1
+        cells.append((i % 33, i // 33))
+        mask ^= low
+    return cells
+
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+else:
+    def popcount(mask):
+        # before Python 3.10, masks are sparse so this beats bin(mask).count("1") on 1089 bit longs
+        count = 0
+        while mask:
+            mask &= mask - 1
+            count += 1
+        return count
+
+
+def is_strict_subset(a, b):
+    return a != b and a & b == a
+
+
+NEIGHBOURS = [(1, -1), (0, -2), (-1, -1), (-1, 1), (0, 2), (1, 1)]
+COMMUNITY = NEIGHBOURS + [
+    (2, -2), (1, -3), (0, -4), (-1, -3), (-2, -2), (-2, 0),
+    (-2, 2), (-1, 3), (0, 4), (1, 3), (2, 2), (2, 0),
+]
+LINE_STEPS = {VERTICAL: (0, 2), LEFT_DIAG: (-1, 1), RIGHT_DIAG: (1, 1)}
+
+
+def on_grid(c):
+    return 0 <= c[0] < 33 and 0 <= c[1] < 33
+
+
+_geometry = None
+
+
+def geometry():
+    """
+    {constraint type: {cell: cells it covers}} for every cell of the 33x33 grid
+
+    The grid is the same for every level so this is only built once. Off grid
+    neighbours are kept as they are gaps in the ring for TOGETHER and APART.
+    """
+    global _geometry
+    if _geometry is None:
+        grid = [(x, y) for y in range(33) for x in range(33)]
+        _geometry = {
+            BASIC: {c: tuple(add(c, o) for o in NEIGHBOURS) for c in grid},
+            AREA: {c: tuple(n for n in (add(c, o) for o in COMMUNITY) if on_grid(n)) for c in grid},
+        }
+        for constraint_type, step in LINE_STEPS.items():
+            lines = {}
+            for c in grid:
+                line = []
+                n = add(c, step)
+                while on_grid(n):
+                    line.append(n)
+                    n = add(n, step)
+                lines[c] = tuple(line)
+            _geometry[constraint_type] = lines
+    return _geometry
+
+
+GRID = [(x, y) for y in range(33) for x in range(33)]
+
+
+def grid_index(c):
+    """ position of c in the flat board arrays, None if it's off the grid """
+    x, y = c
+    if 0 <= x < 33 and 0 <= y < 33:
+        return y * 33 + x
+    return None
+
+
+def parse_cell(parts):
+    """ (color, true value, constraint type, modifier) for a 2 character cell, the type applies once it's revealed """
+    kind, mark = parts
+    if kind == 'O':
+        color = BLACK
+    elif kind == 'X':
+        color = BLUE
+    elif kind in 'ox':
+        color = UNKNOWN
+    elif kind in '\\|/.':
+        color = EMPTY
+    else:
+        assert False
+
+    true_value = 1 if kind in 'xX' else 0
+
+    if mark == '.' or kind == '.':
+        constraint_type = 0
+    elif kind in 'oO':
+        constraint_type = BASIC
+    elif kind in 'xX':
+        constraint_type = AREA
+    elif kind == '\\':
+        constraint_type = RIGHT_DIAG
+    elif kind == '|':
+        constraint_type = VERTICAL
+    elif kind == '/':
+        constraint_type = LEFT_DIAG
+    else:
+        assert False
+
+    if mark == 'c':
+        modifier = TOGETHER
+    elif mark == 'n':
+        modifier = APART
+    else:
+        modifier = 0
+
+    return color, true_value, constraint_type, modifier
+
+
+# every cell is one of these kinds with one of these marks, which packs into 5 bits
+KINDS = ".oOxX\\|/"
+MARKS = ".+cn"
+BOARD_BYTES = (33 * 33 * 5 + 7) // 8
+
+
+def pack_board(kinds, marks):
+    """ a board as BOARD_BYTES bytes, given the two characters of each cell as in Level """
+    value = 0
+    for i in reversed(range(33 * 33)):
+        value = value << 5 | KINDS.index(chr(kinds[i])) * 4 + MARKS.index(chr(marks[i]))
+    return binascii.unhexlify("{0:0{1}x}".format(value, BOARD_BYTES * 2))
+
+
+def unpack_board(data):
+    """ the 33 text lines of a board packed by pack_board """
+    value = int(binascii.hexlify(data), 16)
+    lines = []
+    for y in range(33):
+        row = []
+        for x in range(33):
+            code = value & 31
+            value >>= 5
+            row.append(KINDS[code >> 2] + MARKS[code & 3])
+        lines.append("".join(row))
+    return lines
+
+
 class Cell(object):
-    def __init__(self, parts):
-        self._parts = parts
+    """ a view onto one position of a Level's board """
+    def __init__(self, level, c):
+        self._level = level
+        self._index = grid_index(c)
 
     def __str__(self):
-        if self._parts[0] == ".":
+        kind = chr(self._level._kinds[self._index])
+        if kind == ".":
             return "  "
-        elif self._parts[0] in 'ox':
+        elif self.color == UNKNOWN:
             return ".."
         else:
-            return "".join(self._parts)
+            return kind.upper() + chr(self._level._marks[self._index])
 
-    @cached_property
+    @property
     def color(self):
-        if self._parts[0] == 'O':
-            return BLACK
-        elif self._parts[0] == 'X':
-            return BLUE
-        elif self._parts[0] in 'ox':
-            return UNKNOWN
-        elif self._parts[0] in '\\|/.':
-            return EMPTY
-        else:
-            assert False
+        return self._level._colors[self._index]
 
     @property
     def constraint_type(self):
-        if self._parts[1] == '.':
+        if self.color == UNKNOWN:
             return None
+        return self._level._types[self._index] or None
 
-        if self._parts[0] in 'ox.':
-            return None
-        elif self._parts[0] == 'O':
-            return BASIC
-        elif self._parts[0] == 'X':
-            return AREA
-        elif self._parts[0] == '\\':
-            return RIGHT_DIAG
-        elif self._parts[0] == '|':
-            return VERTICAL
-        elif self._parts[0] == '/':
-            return LEFT_DIAG
-        else:
-            assert False
-
-    @cached_property
+    @property
     def true_value(self):
-        if self._parts[0] in 'xX':
-            return 1
-        return 0
+        return self._level._truth[self._index]
 
-    @cached_property
+    @property
     def modifier(self):
-        if self._parts[1] == 'c':
-            return TOGETHER
-        elif self._parts[1] == 'n':
-            return APART
-        else:
-            return None
-
-    def play(self):
-        assert self._parts[0] in 'ox'
-        self._parts = self._parts[0].upper() + self._parts[1]
-        del self.color
+        return self._level._modifiers[self._index] or None
 
     @property
     def done(self):
-        return self._parts[0] not in 'ox'
+        return self.color != UNKNOWN
 
 
 class Level(object):
@@ -142,156 +377,354 @@ class Level(object):
         A line is a sequence of 33 2-character groups.
         '.' = nothing, 'o' = black, 'O' = black revealed, 'x' = blue, 'X' = blue revealed, '\','|','/' = column number at 3 different angles (-60, 0, 60)
         '.' = blank, '+' = has number, 'c' = consecutive, 'n' = not consecutive
+
+        The board is only parsed the first time something needs it, so a reader
+        can hand out lots of levels without paying for the ones never solved.
         """
-        lines = data.splitlines()
+        self._read(data.splitlines())
+
+    # the flat board arrays, see _parse_body
+    BOARD = ("_kinds", "_marks", "_colors", "_truth", "_types", "_modifiers")
+
+    # grid indexes of the cells colored by assume rather than play
+    _assumed = frozenset()
+
+    @classmethod
+    def from_lines(cls, lines):
+        level = cls.__new__(cls)
+        level._read(lines)
+        return level
+
+    @classmethod
+    def from_board(cls, texts, board):
+        """ a level from its title, author and custom texts and a board packed by pack_board """
+        level = cls.__new__(cls)
+        level.title, level.author, level.custom_text_1, level.custom_text_2 = texts
+        level._body = board
+        level._geometry = geometry()
+        return level
+
+    def _read(self, lines):
         assert lines[0] == "Hexcells level v1"
         self.title = lines[1]
         self.author = lines[2]
         self.custom_text_1 = lines[3]
         self.custom_text_2 = lines[4]
-
-        self._cells = self._parse_body(lines[5:])
-        self._colors = dict()
+        self._body = lines[5:]
+        self._geometry = geometry()
+
+    def __getattr__(self, name):
+        # only called for attributes we don't have yet, so it's free once the board is parsed
+        if name in Level.BOARD:
+            body = self.__dict__.pop("_body", None)
+            if body is not None:
+                self._parse_body(body if isinstance(body, list) else unpack_board(body))
+                return self.__dict__[name]
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # the geometry is the same for everyone, no need to pickle it with every level
+        state = dict(self.__dict__)
+        del state["_geometry"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._geometry = geometry()
 
     def _parse_body(self, lines):
-        cells = {}
+        """
+        Fill in the flat board arrays, all indexed by grid_index
+
+        _kinds and _marks are the two characters as given, _colors is the only
+        one that changes as the level is played
+        """
+        size = 33 * 33
+        self._kinds = bytearray(b"." * size)
+        self._marks = bytearray(b"." * size)
+        self._colors = bytearray([EMPTY] * size)
+        self._truth = bytearray(size)
+        self._types = bytearray(size)
+        self._modifiers = bytearray(size)
         for y, row in enumerate(lines):
-            for x, cell in enumerate(zip(row[::2], row[1::2])):
-                cells[x, y] = Cell(cell)
-        return cells
+            for x, parts in enumerate(zip(row[::2], row[1::2])):
+                i = y * 33 + x
+                self._kinds[i] = ord(parts[0])
+                self._marks[i] = ord(parts[1])
+                color, true_value, constraint_type, modifier = parse_cell(parts)
+                self._colors[i] = color
+                self._truth[i] = true_value
+                self._types[i] = constraint_type
+                self._modifiers[i] = modifier
+
+    def copy(self):
+        """ a copy that can be played independently, only the colors aren't shared """
+        other = object.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        if "_colors" in self.__dict__:
+            other._colors = bytearray(self._colors)
+        return other
+
+    def cell(self, c):
+        return Cell(self, c)
 
     def neighbours(self, cell):
-        for c in [
-            (1, -1),
-            (0, -2),
-            (-1, -1),
-            (-1, 1),
-            (0, 2),
-            (1, 1),
-        ]:
-            yield add(cell, c)
+        return self._geometry[BASIC][cell]
 
     def community(self, cell):
-        for c in self.neighbours(cell):
-            yield c
-        for c in [
-            (2, -2),
-            (1, -3),
-            (0, -4),
-            (-1, -3),
-            (-2, -2),
-            (-2, 0),
-            (-2, 2),
-            (-1, 3),
-            (0, 4),
-            (1, 3),
-            (2, 2),
-            (2, 0),
-        ]:
-            yield add(cell, c)
-
-    def _line(self, cell, step):
-        while True:
-            cell = add(cell, step)
-            if cell not in self._cells:
-                return
-            yield cell
+        return self._geometry[AREA][cell]
 
     def vertical(self, cell):
-        return self._line(cell, (0, 2))
+        return self._geometry[VERTICAL][cell]
 
     def left_diag(self, cell):
-        return self._line(cell, (-1, 1))
+        return self._geometry[LEFT_DIAG][cell]
 
     def right_diag(self, cell):
-        return self._line(cell, (1, 1))
+        return self._geometry[RIGHT_DIAG][cell]
 
     def get_cells(self, cell, constraint_type):
-        return list({
-            BASIC: self.neighbours,
-            AREA: self.community,
-            VERTICAL: self.vertical,
-            LEFT_DIAG: self.left_diag,
-            RIGHT_DIAG: self.right_diag,
-        }[constraint_type](cell))
+        return self._geometry[constraint_type][cell]
 
     def all_cells(self):
-        return self._cells.keys()
+        return GRID
 
     def total_count(self):
-        return self._true_count(self.all_cells())
-
-    def dump(self, reds=None, blues=None):
-        colors = defaultdict(lambda: None)
-        if blues:
-            for c in blues:
-                colors[c] = Back.CYAN
-        if reds:
-            for c in reds:
-                colors[c] = Back.MAGENTA
-
-        s = ""
+        return sum(self._truth)
 
-        for y in range(33):
-            for x in range(33):
-                s += colored(str(self._cells[(x, y)]), colors[x, y])
-                del colors[x, y]
-            s += "\n"
-
-        for key, color in colors.iteritems():
-            s += colored(key, color) + "\n"
-        print s
+    def dump(self, reds=None, blues=None, renderer=None):
+        """ draw the board with the reds and blues highlighted, see Renderer """
+        (renderer or default_renderer()).frame(self, reds, blues)
 
     def get_color(self, c):
-        try:
-            return self._colors[c]
-        except:
-            res = self._cells.get(c, Cell("..")).color
-            self._colors[c] = res
-            return res
+        i = grid_index(c)
+        if i is None:
+            return EMPTY
+        return self._colors[i]
 
     def get_constrant(self, c):
-        t = self._cells.get(c, Cell("..")).constraint_type
-        if t is None:
+        i = grid_index(c)
+        if i is None or not self._types[i] or self._colors[i] == UNKNOWN or i in self._assumed:
             return None
+        t = self._types[i]
         cells = self.get_cells(c, t)
         count = self._true_count(cells)
-        modifier = self._cells[c].modifier
+        modifier = self._modifiers[i] or None
         return t, cells, count, modifier
 
     def _true_count(self, cells):
-        return sum(self._cells.get(c, Cell("..")).true_value for c in cells)
+        count = 0
+        for c in cells:
+            i = grid_index(c)
+            if i is not None:
+                count += self._truth[i]
+        return count
 
     def play(self, c, value):
-        self._cells[c].play()
-        assert self._cells[c].color == value
-        self._colors[c] = value
+        i = grid_index(c)
+        assert self._colors[i] == UNKNOWN
+        self._colors[i] = BLUE if self._truth[i] else BLACK
+        assert self._colors[i] == value
+
+    def assume(self, c, value):
+        """ color c without checking it's right, or revealing any number it would show """
+        i = grid_index(c)
+        assert self._colors[i] == UNKNOWN
+        self._colors[i] = value
+        self._assumed = self._assumed | {i}
+
+    def snapshot(self):
+        """ everything play and assume change, for restore """
+        return bytes(self._colors), self._assumed
+
+    def restore(self, state):
+        colors, self._assumed = state
+        self._colors[:] = colors
 
     def done(self):
-        return all(self._cells[c].done for c in self.all_cells())
+        return UNKNOWN not in self._colors
+
+    def digest(self):
+        """ a hash of the board as it stands, the title and texts don't come into it """
+        import hashlib
+        return hashlib.sha1(bytes(self._kinds) + bytes(self._marks) + bytes(self._colors)).hexdigest()
+
+    def text(self):
+        """ the level in the *.hexcells format, with the cells played so far revealed """
+        lines = ["Hexcells level v1", self.title, self.author, self.custom_text_1, self.custom_text_2]
+        for y in range(33):
+            row = []
+            for i in range(y * 33, y * 33 + 33):
+                kind = chr(self._kinds[i])
+                if kind in "oOxX":
+                    kind = kind.lower() if self._colors[i] == UNKNOWN else kind.upper()
+                row.append(kind + chr(self._marks[i]))
+            lines.append("".join(row))
+        return "\n".join(lines) + "\n"
+
+
+class Renderer(object):
+    """
+    Draws boards a frame at a time to out, stdout if that's None
+
+    Every cell's text revealed and unknown is worked out once per level and
+    each row is kept until its colors or highlights change, so the frame
+    after a move only redraws the rows the move touched. plain leaves out
+    the ANSI colors and lists the highlighted cells under the board instead.
+    """
+    def __init__(self, out=None, plain=False):
+        self.out = out
+        self.plain = plain
+        self._level = None
+
+    def _start(self, level):
+        """ the (revealed, unknown) texts of the level's cells, as Cell.__str__ """
+        self._level = level
+        self._texts = []
+        for kind, mark in zip(level._kinds, level._marks):
+            kind = chr(kind)
+            if kind == ".":
+                self._texts.append(("  ", "  "))
+            else:
+                self._texts.append((kind.upper() + chr(mark), ".."))
+        # (colors, highlights, text) for each row as last drawn
+        self._rows = [(None, None, None)] * 33
+
+    def render(self, level, reds=None, blues=None):
+        """ the frame as a string, reds and blues are cells or names like "global" to highlight """
+        if level is not self._level:
+            self._start(level)
+        # reds win where a cell is both
+        marked = {}
+        for cells, name in [(blues, "CYAN"), (reds, "MAGENTA")]:
+            for c in cells or ():
+                marked[c] = name
+        highlights = defaultdict(list)
+        others = []
+        for c, name in sorted(marked.items(), key=lambda item: (isinstance(item[0], tuple), item[0])):
+            i = grid_index(c) if isinstance(c, tuple) else None
+            if i is None:
+                others.append((c, name))
+            else:
+                highlights[i // 33].append((i % 33, name))
+
+        colors = level._colors
+        texts = self._texts
+        lines = []
+        for y in range(33):
+            start = y * 33
+            row_colors = colors[start:start + 33]
+            row_highlights = highlights.get(y)
+            old_colors, old_highlights, text = self._rows[y]
+            if row_colors != old_colors or row_highlights != old_highlights:
+                parts = [t[1] if color == UNKNOWN else t[0]
+                         for t, color in zip(texts[start:start + 33], row_colors)]
+                if row_highlights and not self.plain:
+                    Back = terminal_colors()
+                    for x, name in row_highlights:
+                        parts[x] = colored(parts[x], getattr(Back, name))
+                text = "".join(parts)
+                self._rows[y] = row_colors, row_highlights, text
+            lines.append(text)
+
+        if self.plain:
+            if blues:
+                lines.append("moves: " + " ".join(str(c) for c in sorted_bases(blues)))
+            if reds:
+                lines.append("from: " + " ".join(str(c) for c in sorted_bases(reds)))
+        else:
+            Back = terminal_colors() if others else None
+            lines.extend(colored(str(c), getattr(Back, name)) for c, name in others)
+        return "\n".join(lines) + "\n"
+
+    def frame(self, level, reds=None, blues=None):
+        text = self.render(level, reds, blues)
+        # after rendering, the first colors wrap stdout
+        (self.out or sys.stdout).write(text + "\n")
+
+
+_renderer = None
+
+
+def default_renderer():
+    """ the Renderer for Level.dump when it isn't given one, straight to stdout """
+    global _renderer
+    if _renderer is None:
+        _renderer = Renderer()
+    return _renderer
 
 
 def transpose(matrix):
-    return zip(*matrix)
+    return list(zip(*matrix))
+
+
+def is_array(patterns):
+    return numpy is not None and isinstance(patterns, numpy.ndarray)
+
+
+def load_numpy():
+    """ numpy for NUMPY, only imported once it's wanted as it's slow to load """
+    global numpy
+    if numpy is None:
+        import numpy
+    return numpy
+
+
+def make_patterns(patterns):
+    if NUMPY:
+        return load_numpy().array(patterns, dtype=numpy.uint8)
+    return patterns
 
 
 def cut_patterns(indicies, patterns, new_cells):
+    if is_array(patterns):
+        keep = [bool(cell_bit(i) & new_cells) for i in indicies]
+        res_i = [i for i, k in zip(indicies, keep) if k]
+        return res_i, numpy.unique(patterns[:, numpy.array(keep)], axis=0)
+
     res_i = []
     res_v = []
     for i, v in zip(indicies, transpose(patterns)):
-        if i in new_cells:
+        if cell_bit(i) & new_cells:
             res_i.append(i)
             res_v.append(v)
     return res_i, transpose(res_v)
 
 
+def pattern_keys(patterns):
+    # one int per row, columns are at most a line of the 33x33 grid long
+    assert patterns.shape[1] < 63
+    return (patterns == BLUE).dot(numpy.left_shift(1, numpy.arange(patterns.shape[1], dtype=numpy.int64)))
+
+
 def intersect_patterns(p1, p2):
+    if is_array(p1):
+        return p1[numpy.isin(pattern_keys(p1), pattern_keys(p2))]
+
     p1 = set(p1)
     p2 = set(p2)
     return p1 & p2
 
 
+def filter_patterns(patterns, known):
+    """ the patterns that agree with the (index, color) pairs in known """
+    if is_array(patterns):
+        columns = [i for i, _ in known]
+        colors = [color for _, color in known]
+        return patterns[(patterns[:, columns] == colors).all(axis=1)]
+
+    return [p for p in patterns if all(p[i] == color for i, color in known)]
+
+
 def limit_patterns(patterns, min_count, max_count):
+    if is_array(patterns):
+        counts = (patterns == BLUE).sum(axis=1)
+        keep = (counts >= min_count) & (counts <= max_count)
+        counts = counts[keep]
+        if not len(counts):
+            return patterns[keep], 1000, 0
+        return patterns[keep], int(counts.min()), int(counts.max())
+
     new_min = 1000
     new_max = 0
     res = []
@@ -304,18 +737,55 @@ def limit_patterns(patterns, min_count, max_count):
     return res, new_min, new_max
 
 
+class Contradiction(Exception):
+    """ the board can't be finished the way it's been played, which only happens to assumed moves """
+
+
 class Constraint(object):
     def __init__(self, bases, cells, min_count, max_count, debug, indicies=None, patterns=None):
+        if min_count > max_count:
+            raise Contradiction("{0} needs {1} to {2} blue".format(debug, min_count, max_count))
         self.bases = frozenset(bases)
-        self.cells = frozenset(cells)
+        self.cells = cells
+        self.size = popcount(cells)
         self.min_count = min_count
         self.max_count = max_count
         self._key = self.cells, self.min_count, self.max_count
-        self.interesting = min_count != 0 or max_count != len(cells)
+        self._hash = hash(self._key)
+        self.interesting = min_count != 0 or max_count != self.size
+        self.lazy = None
+        if isinstance(patterns, LazyPatterns):
+            # we go by our counts until the line is short enough to list
+            self.lazy = patterns
+            indicies = patterns = None
+        elif patterns is not None and not len(patterns):
+            indicies = patterns = None
         self.indicies = indicies
         self.patterns = patterns
         self.debug = debug
 
+    @cached_property
+    def cell_list(self):
+        return mask_cells(self.cells)
+
+    @cached_property
+    def content(self):
+        """ everything about us that what we derive depends on, so not our bases or debug """
+        if self.patterns is None:
+            patterns = None
+        elif is_array(self.patterns):
+            patterns = self.patterns.shape, self.patterns.tobytes()
+        else:
+            patterns = frozenset(self.patterns)
+        indicies = tuple(self.indicies) if self.indicies is not None else None
+        lazy = self.lazy and (tuple(self.lazy.indicies), self.lazy.needed, frozenset(self.lazy.runs))
+        return self._key + (indicies, patterns, lazy)
+
+    def rebased(self, bases, debug):
+        """ the same constraint, derived from somewhere else """
+        return Constraint(bases, self.cells, self.min_count, self.max_count, debug,
+                          indicies=self.indicies, patterns=self.lazy or self.patterns)
+
     @classmethod
     def make(cls, base, cells, min_count, max_count, level, indicies=None, patterns=None):
         cells, min_count, max_count = cls._normalize(cells, min_count, max_count, level)
@@ -326,20 +796,58 @@ class Constraint(object):
     def _normalize(cells, min_count, max_count, level):
         assert 0 <= min_count <= max_count
         blue_count = sum(1 for c in cells if level.get_color(c) == BLUE)
-        cells = {c for c in cells if level.get_color(c) == UNKNOWN}
+        cells = cells_mask(c for c in cells if level.get_color(c) == UNKNOWN)
         min_count = max(0, min_count - blue_count)
-        max_count -= blue_count
-        assert 0 <= min_count <= max_count <= len(cells)
+        max_count = min(max_count - blue_count, popcount(cells))
+        if not 0 <= min_count <= max_count:
+            raise Contradiction("{0} to {1} blue left for {2} cells".format(min_count, max_count, popcount(cells)))
         return cells, min_count, max_count
 
+    def renormalize(self, level):
+        """ drop any of our cells that have since been played, None if that leaves nothing """
+        played = [c for c in self.cell_list if level.get_color(c) != UNKNOWN]
+        if not played:
+            return self
+        cells, min_count, max_count = self._normalize(self.cell_list, self.min_count, self.max_count, level)
+        if not cells:
+            return None
+
+        if self.lazy is not None:
+            # worked out again from the line, it may be short enough to list by now
+            indicies, patterns = self.lazy.remake(level)
+            if not isinstance(patterns, LazyPatterns):
+                patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
+        elif self.patterns is not None:
+            known = [(i, level.get_color(c)) for i, c in enumerate(self.indicies) if c in played]
+            patterns = filter_patterns(self.patterns, known)
+            indicies, patterns = cut_patterns(self.indicies, patterns, cells)
+            patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
+        else:
+            indicies = None
+            patterns = None
+
+        return Constraint(self.bases, cells, min_count, max_count, self.debug, indicies=indicies, patterns=patterns)
+
+    def listed(self):
+        """ the same constraint with its LazyPatterns listed """
+        patterns, min_count, max_count = limit_patterns(make_patterns(list(self.lazy)), self.min_count, self.max_count)
+        return Constraint(self.bases, self.cells, min_count, max_count, self.debug,
+                          indicies=self.lazy.indicies, patterns=patterns)
+
     def get_moves(self, level):
-        if len(self.cells) == 0:
+        if self.size == 0:
             return set()
-        if self.min_count == len(self.cells):
-            return {(c, BLUE) for c in self.cells}
+        if self.min_count == self.size:
+            return {(c, BLUE) for c in self.cell_list}
         if self.max_count == 0:
-            return {(c, BLACK) for c in self.cells}
-        if self.patterns:
+            return {(c, BLACK) for c in self.cell_list}
+        if self.lazy is not None:
+            return set(self.lazy.forced)
+        if is_array(self.patterns):
+            low = self.patterns.min(axis=0)
+            high = self.patterns.max(axis=0)
+            return {(c, int(v)) for c, v, fixed in zip(self.indicies, low, low == high) if fixed}
+        if self.patterns is not None:
             moves = set()
             for c, values in zip(self.indicies, transpose(self.patterns)):
                 if len(set(values)) == 1:
@@ -348,7 +856,7 @@ class Constraint(object):
         return set()
 
     def __hash__(self):
-        return hash(self._key)
+        return self._hash
 
     def __eq__(self, other):
         return self.__class__ == other.__class__ and self._key == other._key
@@ -358,15 +866,14 @@ class Constraint(object):
 
     def get_inverse_subset_constraint(self, other):
         """ if other is a subset of us, return the complement of that subset """
-        if other.cells < self.cells:
+        if is_strict_subset(other.cells, self.cells):
             bases = self.bases | other.bases
-            cells = self.cells - other.cells
+            cells = self.cells & ~other.cells
             min_count = max(self.min_count - other.max_count, 0)
-            max_count = min(self.max_count - other.min_count, len(cells))
-            assert max_count >= min_count
+            max_count = min(self.max_count - other.min_count, self.size - other.size)
             debug = "({0}-{1})".format(self.debug, other.debug)
 
-            if self.patterns:
+            if self.patterns is not None:
                 indicies, patterns = cut_patterns(self.indicies, self.patterns, cells)
                 patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
             else:
@@ -381,24 +888,23 @@ class Constraint(object):
         cells = self.cells & other.cells
         if not cells:
             return None
-        len_cells = len(cells)
-        self_rem = len(self.cells) - len_cells
-        other_rem = len(other.cells) - len_cells
+        len_cells = popcount(cells)
+        self_rem = self.size - len_cells
+        other_rem = other.size - len_cells
         min_count = max(self.min_count - self_rem, other.min_count - other_rem, 0)
         max_count = min(self.max_count, other.max_count, len_cells)
         bases = self.bases | other.bases
-        assert max_count >= min_count
         debug = "({0}&{1})".format(self.debug, other.debug)
 
-        if self.patterns:
+        if self.patterns is not None:
             indicies, patterns = cut_patterns(self.indicies, self.patterns, cells)
-            if other.patterns:
+            if other.patterns is not None:
                 indicies2, patterns2 = cut_patterns(other.indicies, other.patterns, cells)
                 assert indicies == indicies2
                 patterns = intersect_patterns(patterns, patterns2)
             patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
         else:
-            if other.patterns:
+            if other.patterns is not None:
                 indicies, patterns = cut_patterns(other.indicies, other.patterns, cells)
                 patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
             else:
@@ -414,26 +920,34 @@ class Constraint(object):
         assert self.cells == other.cells
         min_count = max(self.min_count, other.min_count)
         max_count = min(self.max_count, other.max_count)
-        if self.min_count == min_count and self.max_count == max_count:
-            return None
-        if other.min_count == min_count and other.max_count == max_count:
-            return other
+        # the shortcuts would throw away other's patterns
+        if other.patterns is None and (other.lazy is None or self.lazy is not None):
+            if self.min_count == min_count and self.max_count == max_count:
+                return None
+            if other.min_count == min_count and other.max_count == max_count and \
+                    self.patterns is None and self.lazy is None:
+                return other
         debug = "{0}%{1}".format(self.debug, other.debug)
 
-        if self.patterns:
+        if self.patterns is not None:
             indicies, patterns = self.indicies, self.patterns
-            if other.patterns:
+            if other.patterns is not None:
                 indicies2, patterns2 = other.indicies, other.patterns
                 assert indicies == indicies2
                 patterns = intersect_patterns(patterns, patterns2)
             patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
         else:
-            if other.patterns:
+            if other.patterns is not None:
                 indicies, patterns = other.indicies, other.patterns
                 patterns, min_count, max_count = limit_patterns(patterns, min_count, max_count)
             else:
                 indicies = None
-                patterns = None
+                # listed patterns say everything the lazy ones do
+                patterns = self.lazy or other.lazy
+
+        if self.patterns is not None and len(patterns) == len(self.patterns) and \
+                self.min_count == min_count and self.max_count == max_count:
+            return None
 
         return Constraint(self.bases | other.bases, self.cells, min_count, max_count, debug, indicies=indicies, patterns=patterns)
 
@@ -496,22 +1010,161 @@ def eval_modifier(cells, count, is_valid, wrap, level):
             values.append(new_colors)
     return indicies, transpose(values)
 
-def disjoint(base, cells, count, loop, level):
-    def is_valid(new_colors):
-        state = 0
-        for c in new_colors:
-            if state == 0:  # looking for blues
-                if c == BLUE:
-                    state = 1
-            if state == 1:  # looking for a gap
-                if c != BLUE:
-                    state = 2
-            if state == 2:  # looking for more blues
-                if c == BLUE:
-                    return True
-        return False
 
-    indicies, valid = eval_modifier(cells, count, is_valid, loop, level)
+def is_disjoint(new_colors):
+    state = 0
+    for c in new_colors:
+        if state == 0:  # looking for blues
+            if c == BLUE:
+                state = 1
+        if state == 1:  # looking for a gap
+            if c != BLUE:
+                state = 2
+        if state == 2:  # looking for more blues
+            if c == BLUE:
+                return True
+    return False
+
+
+def is_joint(new_colors):
+    state = 0
+    for c in new_colors:
+        if state == 0:  # looking for blues
+            if c == BLUE:
+                state = 1
+        if state == 1:  # looking for a gap
+            if c != BLUE:
+                state = 2
+        if state == 2:  # check no more blues
+            if c == BLUE:
+                return False
+    return True
+
+
+def blue_runs(colors, count, wrap):
+    """ for each way of making count contiguous blues, the unknown positions that would need to be blue """
+    size = len(colors)
+    blue_count = sum(1 for x in colors if x == BLUE)
+    if count == 0:
+        if blue_count == 0:
+            yield frozenset()
+        return
+    if count > size:
+        return
+    if wrap and count < size:
+        starts = range(size)
+    else:
+        starts = range(size - count + 1)
+    for start in starts:
+        run = [(start + i) % size for i in range(count)]
+        if all(colors[i] in (BLUE, UNKNOWN) for i in run) and \
+                sum(1 for i in run if colors[i] == BLUE) == blue_count:
+            yield frozenset(i for i in run if colors[i] == UNKNOWN)
+
+
+def modifier_patterns(cells, count, together, wrap, level):
+    """
+    Same result as eval_modifier with is_joint or is_disjoint but works from the
+    handful of contiguous runs rather than checking every blue placement
+
+    APART lines with more than PATTERN_LIMIT placements get LazyPatterns
+    """
+    if not wrap:
+        cells = [c for c in cells if level.get_color(c) != EMPTY]
+
+    current_colors = [level.get_color(c) for c in cells]
+    unknown = sorted((c, i) for i, (c, x) in enumerate(zip(cells, current_colors)) if x == UNKNOWN)
+    indicies = [c for c, _ in unknown]
+    positions = [i for _, i in unknown]
+    if not positions:
+        return [], []
+
+    def pattern(blues):
+        return tuple(BLUE if i in blues else BLACK for i in positions)
+
+    runs = set(blue_runs(current_colors, count, wrap))
+    if together:
+        patterns = [pattern(run) for run in runs]
+    else:
+        # everything that isn't a single run, which needs at least one blue
+        needed = count - sum(1 for x in current_colors if x == BLUE)
+        patterns = []
+        # a wrong assumption while probing can leave more blues than the count
+        if count and needed >= 0:
+            if choose(len(positions), needed) - len(runs) > PATTERN_LIMIT:
+                return indicies, LazyPatterns(cells, count, wrap, indicies, positions, needed, runs)
+            for blues in itertools.combinations(positions, needed):
+                blues = frozenset(blues)
+                if blues not in runs:
+                    patterns.append(pattern(blues))
+
+    if not patterns:
+        # a lone blue can't be apart, and a count of none has no blues to place
+        if count > 1 or together and count:
+            raise Contradiction("no arrangement of {0} blue fits".format(count))
+        return [], []
+    return indicies, make_patterns(patterns)
+
+
+def choose(n, k):
+    """ how many ways to pick k of n, math.comb is newer than python 2 """
+    if not 0 <= k <= n:
+        return 0
+    res = 1
+    for i in range(min(k, n - k)):
+        res = res * (n - i) // (i + 1)
+    return res
+
+
+class LazyPatterns(object):
+    """
+    The arrangements of an APART line with too many of them to list, every
+    way of placing needed blues on the unknown positions but the single runs
+
+    A constraint holding these goes by its counts in the arithmetic until
+    subsets run out of moves, when Solver.list_lazy lists them, and takes its
+    own moves from counting arrangements rather than listing them. Iterating
+    lists them, for the exact searches.
+    """
+    def __init__(self, line, count, wrap, indicies, positions, needed, runs):
+        self.line = line
+        self.count = count
+        self.wrap = wrap
+        self.indicies = indicies
+        self.positions = positions
+        self.needed = needed
+        self.runs = runs
+
+    def __len__(self):
+        return choose(len(self.positions), self.needed) - len(self.runs)
+
+    def __iter__(self):
+        for blues in itertools.combinations(self.positions, self.needed):
+            blues = frozenset(blues)
+            if blues not in self.runs:
+                yield tuple(BLUE if i in blues else BLACK for i in self.positions)
+
+    @cached_property
+    def forced(self):
+        """ the (cell, color)s every arrangement agrees on """
+        n = len(self.positions)
+        res = []
+        for c, i in zip(self.indicies, self.positions):
+            runs_with = sum(1 for run in self.runs if i in run)
+            if choose(n - 1, self.needed - 1) == runs_with:
+                # the only ways of making c blue are single runs
+                res.append((c, BLACK))
+            elif choose(n - 1, self.needed) == len(self.runs) - runs_with:
+                res.append((c, BLUE))
+        return res
+
+    def remake(self, level):
+        """ modifier_patterns for the line as the level stands now """
+        return modifier_patterns(self.line, self.count, False, self.wrap, level)
+
+
+def disjoint(base, cells, count, loop, level):
+    indicies, valid = modifier_patterns(cells, count, False, loop, level)
     cs = Constraint.make(base, cells, count, count, level, indicies, valid)
     moves = cs.get_moves(level)
     if moves:
@@ -522,21 +1175,7 @@ def disjoint(base, cells, count, loop, level):
 
 
 def joint(base, cells, count, loop, level):
-    def is_valid(new_colors):
-        state = 0
-        for c in new_colors:
-            if state == 0:  # looking for blues
-                if c == BLUE:
-                    state = 1
-            if state == 1:  # looking for a gap
-                if c != BLUE:
-                    state = 2
-            if state == 2:  # check no more blues
-                if c == BLUE:
-                    return False
-        return True
-
-    indicies, valid = eval_modifier(cells, count, is_valid, loop, level)
+    indicies, valid = modifier_patterns(cells, count, True, loop, level)
     cs = Constraint.make(base, cells, count, count, level, indicies, valid)
     moves = cs.get_moves(level)
     if moves:
@@ -568,12 +1207,911 @@ def intersection(cs1, cs2, level):
     return None, None
 
 
+def pack_constraint(cs):
+    """ what subset and intersection need of cs, without its bases or debug """
+    return cs.cells, cs.min_count, cs.max_count, cs.indicies, cs.patterns
+
+
+def pack_pairs(constraints):
+    """ the constraints, taken two at a time as pairs, as a table of the distinct ones and pairs of indexes into it """
+    table = []
+    index = {}
+    for cs in constraints:
+        if cs.cells not in index:
+            index[cs.cells] = len(table)
+            table.append(pack_constraint(cs))
+    indexes = [index[cs.cells] for cs in constraints]
+    return table, list(zip(indexes[::2], indexes[1::2]))
+
+
+def _derive_packed(args):
+    """
+    a pool worker's chunk of Solver.derive_pairs_pooled, (k, moves, packed
+    constraint) for each pair k that made anything
+    """
+    name, (table, pairs) = args
+    rule = subset if name == "subset" else intersection
+    constraints = [Constraint((), cells, min_count, max_count, "", indicies, patterns)
+                   for cells, min_count, max_count, indicies, patterns in table]
+    results = []
+    for k, (i, j) in enumerate(pairs):
+        # neither rule looks at the level
+        moves, cs = rule(constraints[i], constraints[j], None)
+        if moves or cs:
+            results.append((k, moves, cs and pack_constraint(cs)))
+    return results
+
+
+# one pool per process for Solver.derive_pairs_pooled
+_pools = {}
+
+
+def shared_pool(jobs):
+    import multiprocessing
+    if jobs not in _pools:
+        _pools[jobs] = multiprocessing.Pool(jobs)
+    return _pools[jobs]
+
+
+class DerivationCache(object):
+    """
+    A bounded cache of what subset and intersection made of pairs of
+    constraints, keyed on their content so it holds across passes, moves and
+    levels
+
+    It's LRU by generations: entries go in the current dict and move over from
+    the previous one when they're used, when the current one is half the size
+    it becomes the previous one and whatever wasn't used since goes.
+    OrderedDict is pure python here and cost more than the derivations.
+    """
+    # how a derived constraint describes where it came from, as in Constraint
+    DEBUG = {"subset": "({0}-{1})", "intersection": "({0}&{1})"}
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.current = {}
+        self.previous = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+    def derive(self, rule, cs1, cs2, level):
+        """ rule(cs1, cs2, level), from the cache if we've seen this pair before """
+        key = rule.__name__, cs1.content, cs2.content
+        res = self.current.get(key)
+        if res is None:
+            res = self.previous.pop(key, None)
+            if res is None:
+                self.misses += 1
+                res = rule(cs1, cs2, level)
+                self.store(key, res)
+                return res
+            self.store(key, res)
+        self.hits += 1
+        moves, cs = res
+        if cs is not None:
+            cs = cs.rebased(cs1.bases | cs2.bases, self.DEBUG[rule.__name__].format(cs1.debug, cs2.debug))
+        return moves, cs
+
+    def store(self, key, res):
+        if len(self.current) >= self.size // 2:
+            self.previous = self.current
+            self.current = {}
+        self.current[key] = res
+
+    def __str__(self):
+        return "cache {0}/{1} entries, {2} hits, {3} misses".format(len(self), self.size, self.hits, self.misses)
+
+
+# one cache per process, shared by all the levels solved in it
+_caches = {}
+
+
+def shared_cache(size):
+    if size not in _caches:
+        _caches[size] = DerivationCache(size)
+    return _caches[size]
+
+
+def constraint_score(cs):
+    """ lower is more promising for the scheduler, small constraints with tight counts """
+    return cs.size + cs.max_count - cs.min_count
+
+
+def can_intersect(cs1, cs2):
+    """ whether get_intersection could come up with anything, without building it """
+    if cs1.patterns is not None or cs2.patterns is not None:
+        return True
+    shared = popcount(cs1.cells & cs2.cells)
+    min_count = max(cs1.min_count - cs1.size + shared, cs2.min_count - cs2.size + shared)
+    max_count = min(cs1.max_count, cs2.max_count)
+    return min_count > 0 or max_count < shared
+
+
+class SearchLimit(Exception):
+    pass
+
+
+class Component(object):
+    """
+    A group of unknown cells tied together by constraints, and an exact
+    search over all the colorings of them that satisfy those constraints
+
+    constraints are (cells, min_count, max_count, patterns) where patterns is
+    None or a list of 0/1 tuples in the same order as cells
+    """
+    def __init__(self, cells, constraints, bases):
+        self.bases = bases
+        self.cells = self._order(cells, constraints)
+        position = {c: i for i, c in enumerate(self.cells)}
+        self.constraints = []
+        for cells, min_count, max_count, patterns in constraints:
+            # keep each constraint's cells, and its patterns, in search order
+            order = sorted(range(len(cells)), key=lambda j: position[cells[j]])
+            positions = [position[cells[j]] for j in order]
+            if patterns is not None:
+                patterns = [tuple(p[j] for j in order) for p in patterns]
+            self.constraints.append((positions, min_count, max_count, patterns))
+
+        # for each position, the constraints involving it and how many of their cells come after it
+        self.at = [[] for _ in self.cells]
+        for n, (positions, _, _, _) in enumerate(self.constraints):
+            for k, i in enumerate(positions):
+                self.at[i].append((n, k, len(positions) - k - 1))
+        # the constraints that are part way through at each position, these make up the memo key
+        self.active = []
+        for i in range(len(self.cells) + 1):
+            self.active.append(tuple(
+                n for n, (positions, _, _, _) in enumerate(self.constraints)
+                if positions[0] < i <= positions[-1]
+            ))
+
+    @staticmethod
+    def _order(cells, constraints):
+        """ order the cells so that constraints are started and finished close together """
+        links = defaultdict(set)
+        for cs_cells, _, _, _ in constraints:
+            for c in cs_cells:
+                links[c].update(cs_cells)
+        remaining = set(cells)
+        order = []
+        weight = defaultdict(int)
+        while remaining:
+            c = max(remaining, key=lambda c: (weight[c], -c[1], -c[0]))
+            remaining.remove(c)
+            order.append(c)
+            for n in links[c]:
+                weight[n] += 1
+        return order
+
+    def search(self, limit):
+        """
+        {blue count: (cells that are blue in some solution, cells that are blue in every solution)}
+
+        The masks are over search positions, raises SearchLimit after limit memo entries
+        """
+        memo = {}
+        size = len(self.cells)
+        initial = [None] * len(self.constraints)
+        for n, (positions, _, _, patterns) in enumerate(self.constraints):
+            initial[n] = 0 if patterns is None else (1 << len(patterns)) - 1
+
+        def solve(i, state):
+            if i == size:
+                return {0: (0, 0)}
+            key = i, tuple(state[n] for n in self.active[i])
+            res = memo.get(key)
+            if res is not None:
+                return res
+            if len(memo) >= limit:
+                raise SearchLimit()
+
+            res = {}
+            for value in (0, 1):
+                new_state = list(state)
+                for n, k, remaining in self.at[i]:
+                    positions, min_count, max_count, patterns = self.constraints[n]
+                    if patterns is None:
+                        blues = new_state[n] + value
+                        if blues > max_count or blues + remaining < min_count:
+                            break
+                        new_state[n] = blues
+                    else:
+                        alive = new_state[n]
+                        for j, p in enumerate(patterns):
+                            if alive >> j & 1 and p[k] != value:
+                                alive &= ~(1 << j)
+                        if not alive:
+                            break
+                        new_state[n] = alive
+                else:
+                    bit = value << i
+                    for count, (some, every) in solve(i + 1, new_state).items():
+                        count += value
+                        some |= bit
+                        every |= bit
+                        if count in res:
+                            old_some, old_every = res[count]
+                            res[count] = old_some | some, old_every & every
+                        else:
+                            res[count] = some, every
+            memo[key] = res
+            return res
+
+        return solve(0, initial)
+
+
+def level_constraints(level):
+    """
+    The revealed constraints on the unknown cells as (base, cells, min_count, max_count, patterns)
+
+    patterns is None or a list of 0/1 tuples in the same order as cells, in
+    which case the counts are None
+    """
+    constraints = []
+    for c in level.all_cells():
+        res = level.get_constrant(c)
+        if not res:
+            continue
+        cs_type, cells, count, modifier = res
+        if modifier:
+            indicies, patterns = modifier_patterns(cells, count, modifier == TOGETHER, cs_type == BASIC, level)
+            if not indicies:
+                continue
+            patterns = [tuple(int(x == BLUE) for x in p) for p in patterns]
+            constraints.append((c, list(indicies), None, None, patterns))
+        else:
+            blues = sum(1 for n in cells if level.get_color(n) == BLUE)
+            cells = [n for n in cells if level.get_color(n) == UNKNOWN]
+            if cells:
+                constraints.append((c, cells, count - blues, count - blues, None))
+    return constraints
+
+
+def components(level):
+    """ split the unknown cells by the constraints on them, returns the components and the unconstrained cells """
+    unknown = [c for c in level.all_cells() if level.get_color(c) == UNKNOWN]
+    constraints = level_constraints(level)
+
+    # union find over the cells
+    parent = {c: c for c in unknown}
+    def find(c):
+        while parent[c] != c:
+            parent[c] = parent[parent[c]]
+            c = parent[c]
+        return c
+    for _, cells, _, _, _ in constraints:
+        root = find(cells[0])
+        for c in cells[1:]:
+            parent[find(c)] = root
+
+    grouped = defaultdict(list)
+    for base, cells, min_count, max_count, patterns in constraints:
+        grouped[find(cells[0])].append((base, (cells, min_count, max_count, patterns)))
+    members = defaultdict(list)
+    for c in unknown:
+        members[find(c)].append(c)
+
+    result = []
+    free = []
+    for root, cells in members.items():
+        if root in grouped:
+            bases = {base for base, _ in grouped[root]}
+            result.append(Component(cells, [cs for _, cs in grouped[root]], bases))
+        else:
+            free.extend(cells)
+    return result, free
+
+
+def subset_sums(options):
+    """ every total you can get by picking one number from each set in options """
+    sums = {0}
+    for values in options:
+        sums = {s + v for s in sums for v in values}
+    return sums
+
+
+def component_moves(level, limit=200000):
+    """
+    Every move that holds in all the colorings consistent with the revealed
+    constraints and the remaining blue count, along with the base cells they
+    come from. Components whose search exceeds limit memo entries are skipped.
+    """
+    found, free = components(level)
+    remaining = level.total_count() - sum(1 for c in level.all_cells() if level.get_color(c) == BLUE)
+
+    searched = []
+    for component in found:
+        try:
+            searched.append((component, component.search(limit)))
+        except SearchLimit:
+            if DEBUG > 20: print("component search limit", len(component.cells))
+            # anything is possible as far as we know
+            size = len(component.cells)
+            full = (1 << size) - 1
+            searched.append((None, {k: (full, 0) for k in range(size + 1)}))
+
+    moves = set()
+    bases = set()
+    for i, (component, counts) in enumerate(searched):
+        if component is None:
+            continue
+        others = subset_sums(set(res.keys()) for _, res in searched[:i] + searched[i + 1:])
+        some = 0
+        every = None
+        for count, (count_some, count_every) in counts.items():
+            if any(0 <= remaining - count - s <= len(free) for s in others):
+                some |= count_some
+                every = count_every if every is None else every & count_every
+        if every is None:
+            raise Contradiction("no consistent coloring")
+        forced = set()
+        for j, c in enumerate(component.cells):
+            if every >> j & 1:
+                forced.add((c, BLUE))
+            elif not some >> j & 1:
+                forced.add((c, BLACK))
+        if forced:
+            moves.update(forced)
+            bases.update(component.bases)
+
+    if free:
+        totals = subset_sums(set(res.keys()) for _, res in searched)
+        spare = {remaining - s for s in totals if 0 <= remaining - s <= len(free)}
+        if spare == {len(free)}:
+            moves.update((c, BLUE) for c in free)
+        elif spare == {0}:
+            moves.update((c, BLACK) for c in free)
+
+    return moves, bases
+
+
+class CNF(object):
+    """ clauses over numbered variables, a negative literal is a negated variable """
+    def __init__(self):
+        self.nvars = 0
+        self.clauses = []
+
+    def var(self):
+        self.nvars += 1
+        return self.nvars
+
+    def add(self, clause):
+        self.clauses.append(list(clause))
+
+    def count(self, lits, min_count, max_count):
+        """
+        between min_count and max_count of lits are true, as a sequential counter
+
+        at[j] after literal i is a variable that's true exactly when at least
+        j + 1 of the first i + 1 literals are
+        """
+        n = len(lits)
+        if min_count > n or max_count < 0 or min_count > max_count:
+            self.add([])
+            return
+        if min_count <= 0 and max_count >= n:
+            return
+        width = max(min_count, max_count + 1 if max_count < n else 0)
+        at = []
+        for i, x in enumerate(lits):
+            new = [self.var() for _ in range(min(i + 1, width))]
+            for j, r in enumerate(new):
+                below = at[j - 1] if j > 0 else None
+                same = at[j] if j < len(at) else None
+                # r <- same, r <- below and x
+                if same is not None:
+                    self.add([-same, r])
+                self.add([-x, r] + ([-below] if below is not None else []))
+                # r -> same or x, r -> same or below
+                self.add([-r, x] + ([same] if same is not None else []))
+                if below is not None:
+                    self.add([-r, below] + ([same] if same is not None else []))
+            at = new
+        if min_count > 0:
+            self.add([at[min_count - 1]])
+        if max_count < n:
+            self.add([-at[max_count]])
+
+    def patterns(self, lits, patterns):
+        """ lits match one of the 0/1 patterns """
+        choices = []
+        for p in patterns:
+            choice = self.var()
+            choices.append(choice)
+            for x, value in zip(lits, p):
+                self.add([-choice, x if value else -x])
+        self.add(choices)
+
+
+class SatSolver(object):
+    """
+    A small CDCL solver, watched literals, first UIP learning, activity
+    ordering and restarts. The clauses it learns are kept between calls to
+    solve, so asking lots of questions of the same level stays cheap.
+    """
+    def __init__(self, cnf):
+        n = cnf.nvars + 1
+        self.value = [0] * n
+        self.level = [0] * n
+        self.reason = [None] * n
+        self.phase = [-1] * n
+        self.activity = [0.0] * n
+        self.bump = 1.0
+        self.heap = [(0.0, v) for v in range(1, n)]
+        self.trail = []
+        self.limits = []
+        self.head = 0
+        self.clauses = []
+        self.watches = defaultdict(list)
+        self.ok = True
+        for clause in cnf.clauses:
+            self.add_clause(clause)
+
+    def add_clause(self, clause):
+        clause = list(set(clause))
+        if any(-x in clause for x in clause):
+            return
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            x = clause[0]
+            if self.lit_value(x) < 0:
+                self.ok = False
+            elif not self.lit_value(x):
+                self.assign(x, None)
+        else:
+            self.watch(clause)
+
+    def watch(self, clause):
+        index = len(self.clauses)
+        self.clauses.append(clause)
+        self.watches[clause[0]].append(index)
+        self.watches[clause[1]].append(index)
+        return index
+
+    def lit_value(self, x):
+        return self.value[x] if x > 0 else -self.value[-x]
+
+    def assign(self, x, reason):
+        v = abs(x)
+        self.value[v] = 1 if x > 0 else -1
+        self.level[v] = len(self.limits)
+        self.reason[v] = reason
+        self.trail.append(x)
+
+    def propagate(self):
+        """ returns the index of a conflicting clause or None """
+        value = self.value
+        while self.head < len(self.trail):
+            false = -self.trail[self.head]
+            self.head += 1
+            watching = self.watches[false]
+            keep = []
+            for i, index in enumerate(watching):
+                clause = self.clauses[index]
+                if clause[0] == false:
+                    clause[0], clause[1] = clause[1], false
+                first = clause[0]
+                if (value[first] if first > 0 else -value[-first]) > 0:
+                    keep.append(index)
+                    continue
+                for k in range(2, len(clause)):
+                    x = clause[k]
+                    if (value[x] if x > 0 else -value[-x]) >= 0:
+                        clause[1], clause[k] = x, false
+                        self.watches[x].append(index)
+                        break
+                else:
+                    keep.append(index)
+                    if (value[first] if first > 0 else -value[-first]) < 0:
+                        keep.extend(watching[i + 1:])
+                        self.watches[false] = keep
+                        return index
+                    self.assign(first, index)
+            self.watches[false] = keep
+        return None
+
+    def analyze(self, conflict):
+        """ the first UIP clause learnt from conflict, with the asserting literal first """
+        learnt = [None]
+        seen = set()
+        current = len(self.limits)
+        pending = 0
+        x = None
+        i = len(self.trail) - 1
+        clause = self.clauses[conflict]
+        while True:
+            for y in clause:
+                v = abs(y)
+                if y == x or v in seen or self.level[v] == 0:
+                    continue
+                seen.add(v)
+                self.bump_var(v)
+                if self.level[v] == current:
+                    pending += 1
+                else:
+                    learnt.append(y)
+            while abs(self.trail[i]) not in seen:
+                i -= 1
+            x = self.trail[i]
+            i -= 1
+            pending -= 1
+            if not pending:
+                break
+            clause = self.clauses[self.reason[abs(x)]]
+        learnt[0] = -x
+        self.bump *= 1.05
+        if self.bump > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.bump *= 1e-100
+            self.heap = [(-self.activity[v], v) for v in range(1, len(self.value)) if not self.value[v]]
+            heapq.heapify(self.heap)
+        return learnt
+
+    def bump_var(self, v):
+        self.activity[v] += self.bump
+        if not self.value[v]:
+            heapq.heappush(self.heap, (-self.activity[v], v))
+
+    def backtrack(self, level):
+        if len(self.limits) <= level:
+            return
+        for x in self.trail[self.limits[level]:]:
+            v = abs(x)
+            self.phase[v] = self.value[v]
+            self.value[v] = 0
+            self.reason[v] = None
+            heapq.heappush(self.heap, (-self.activity[v], v))
+        del self.trail[self.limits[level]:]
+        del self.limits[level:]
+        self.head = len(self.trail)
+
+    def decide(self):
+        while self.heap:
+            _, v = heapq.heappop(self.heap)
+            if not self.value[v]:
+                return v * self.phase[v]
+        return None
+
+    def solve(self, assumptions=()):
+        """ a model as a list of bools indexed by variable, or None if there isn't one """
+        self.backtrack(0)
+        if not self.ok or self.propagate() is not None:
+            self.ok = False
+            return None
+        restart = 100
+        conflicts = 0
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                if not self.limits:
+                    self.ok = False
+                    return None
+                conflicts += 1
+                learnt = self.analyze(conflict)
+                back = max(self.level[abs(x)] for x in learnt[1:]) if len(learnt) > 1 else 0
+                self.backtrack(back)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    # watch the literal from the level we jumped back to
+                    k = max(range(1, len(learnt)), key=lambda k: self.level[abs(learnt[k])])
+                    learnt[1], learnt[k] = learnt[k], learnt[1]
+                    self.assign(learnt[0], self.watch(learnt))
+                continue
+            if conflicts >= restart:
+                conflicts = 0
+                restart = int(restart * 1.5)
+                self.backtrack(0)
+                continue
+            if len(self.limits) < len(assumptions):
+                x = assumptions[len(self.limits)]
+                if self.lit_value(x) < 0:
+                    self.backtrack(0)
+                    return None
+                self.limits.append(len(self.trail))
+                if not self.lit_value(x):
+                    self.assign(x, None)
+                continue
+            x = self.decide()
+            if x is None:
+                model = [v > 0 for v in self.value]
+                self.backtrack(0)
+                return model
+            self.limits.append(len(self.trail))
+            self.assign(x, None)
+
+
+class PycosatSolver(object):
+    """ the same interface as SatSolver on top of pycosat """
+    def __init__(self, cnf):
+        self.cnf = cnf
+
+    def solve(self, assumptions=()):
+        res = pycosat.solve(self.cnf.clauses + [[x] for x in assumptions], vars=self.cnf.nvars)
+        if res == "UNSAT":
+            return None
+        model = [False] * (self.cnf.nvars + 1)
+        for x in res:
+            if x > 0:
+                model[x] = True
+        return model
+
+
+def load_pycosat():
+    """ pycosat, or None if it isn't installed, only looked for once the SAT backend is used """
+    global pycosat
+    if pycosat is False:
+        try:
+            import pycosat
+        except ImportError:
+            pycosat = None
+    return pycosat
+
+
+def sat_solver(cnf):
+    if load_pycosat() is not None:
+        return PycosatSolver(cnf)
+    return SatSolver(cnf)
+
+
+def level_cnf(level):
+    """ the level as CNF, returns it, the variable for each unknown cell and the constraints used """
+    cnf = CNF()
+    variables = {}
+    for c in level.all_cells():
+        if level.get_color(c) == UNKNOWN:
+            variables[c] = cnf.var()
+    constraints = level_constraints(level)
+    for base, cells, min_count, max_count, patterns in constraints:
+        lits = [variables[c] for c in cells]
+        if patterns is None:
+            cnf.count(lits, min_count, max_count)
+        else:
+            cnf.patterns(lits, patterns)
+    remaining = level.total_count() - sum(1 for c in level.all_cells() if level.get_color(c) == BLUE)
+    cnf.count(list(variables.values()), remaining, remaining)
+    return cnf, variables, constraints
+
+
+def sat_moves(level):
+    """
+    Every move that holds in all the colorings consistent with the revealed
+    constraints and the remaining blue count, along with the base cells of the
+    constraints on them. A cell is forced when the solver can't find a coloring
+    with it the other way round.
+    """
+    cnf, variables, constraints = level_cnf(level)
+    sat = sat_solver(cnf)
+    model = sat.solve()
+    if model is None:
+        raise Contradiction("no consistent coloring")
+    # cells that have been seen both ways in some model don't need asking about
+    undecided = {c: model[v] for c, v in variables.items()}
+    moves = set()
+    for c, v in sorted(variables.items()):
+        if c not in undecided:
+            continue
+        blue = undecided.pop(c)
+        other = sat.solve([-v if blue else v])
+        if other is None:
+            moves.add((c, BLUE if blue else BLACK))
+        else:
+            for n in list(undecided):
+                if other[variables[n]] != undecided[n]:
+                    del undecided[n]
+
+    moved = {c for c, _ in moves}
+    bases = {base for base, cells, _, _, _ in constraints if moved.intersection(cells)}
+    return moves, bases
+
+
+class UnprovenMoves(Exception):
+    """ check found moves the SAT backend can't prove, so a rule is wrong """
+
+
+def sat_check(level, moves):
+    """ the moves that the SAT backend can't prove from the current level """
+    cnf, variables, _ = level_cnf(level)
+    sat = sat_solver(cnf)
+    return {(c, color) for c, color in moves
+            if sat.solve([-variables[c] if color == BLUE else variables[c]]) is not None}
+
+
+class PhaseStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.pairs = 0
+        self.constraints = 0
+        self.moves = 0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class SolverStats(object):
+    """
+    What the solver has been up to, per phase and overall
+
+    eval_modifier is the pattern building for TOGETHER and APART constraints,
+    it happens inside evaluate and update and is included in their figures too
+    """
+    PHASES = [
+        "evaluate", "update", "arithmetic", "advanced_arithmetic", "global_constraint", "eval_modifier",
+        "scheduled_pairs", "component_search", "sat_search", "sat_check", "probe",
+    ]
+
+    def __init__(self):
+        self.phases = {name: PhaseStats() for name in self.PHASES}
+        self.current = None
+        self.moves = 0
+        self.constraints = 0
+        self.merges = 0
+        self.discards = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.pruned = 0
+        self.evicted = 0
+        # the most constraints the store has held at once
+        self.peak = 0
+
+    def as_dict(self):
+        return {
+            "moves": self.moves,
+            "constraints": self.constraints,
+            "merges": self.merges,
+            "discards": self.discards,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "pruned": self.pruned,
+            "evicted": self.evicted,
+            "peak": self.peak,
+            "phases": {name: phase.as_dict() for name, phase in self.phases.items()},
+        }
+
+    def __str__(self):
+        row = "{0:20} {1:>6} {2:>9} {3:>9} {4:>9} {5:>6}"
+        lines = [row.format("phase", "calls", "time", "pairs", "cons", "moves")]
+        for name in self.PHASES:
+            p = self.phases[name]
+            lines.append(row.format(name, p.calls, "{0:.3f}".format(p.time), p.pairs, p.constraints, p.moves))
+        lines.append("moves {0}, constraints {1}, merges {2}, discards {3}, cache hits {4}, misses {5}".format(
+            self.moves, self.constraints, self.merges, self.discards, self.cache_hits, self.cache_misses))
+        lines.append("pruned {0}, evicted {1}, peak store {2}".format(self.pruned, self.evicted, self.peak))
+        return "\n".join(lines)
+
+
+def phase(name):
+    """ record time, calls and moves found against the named phase in Solver.stats """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            stats = self.stats.phases[name]
+            outer, self.stats.current = self.stats.current, name
+            start = time.time()
+            try:
+                moves, cs = method(self, *args)
+            finally:
+                stats.time += time.time() - start
+                stats.calls += 1
+                self.stats.current = outer
+            if moves:
+                stats.moves += len(moves)
+            if self.on_stats:
+                self.on_stats(name, self.stats)
+            return moves, cs
+        return wrapper
+    return decorator
+
+
 class Solver(object):
-    def __init__(self, level):
+    def __init__(self, level, incremental=False, on_stats=None, exhaustive=False, stall_pairs=20000,
+                 sat=False, check=False, scheduled=False, batched=False, cache=None, results=None,
+                 probe=False, probe_depth=20, probe_pairs=1000, probe_pool=None, hypothetical=False,
+                 renderer=None, pair_jobs=0, pair_chunk=2000, prune=False, max_constraints=None):
+        """
+        on_stats is called with the phase name and stats after each phase runs
+
+        exhaustive falls back to component_moves when the rules stop finding
+        moves, or when they've tried stall_pairs pairs without finding any,
+        sat uses sat_moves for that instead and implies exhaustive
+
+        check proves every batch of moves with the SAT backend before playing it
+
+        scheduled replaces the arithmetic sweeps with a queue of constraints to pair
+        up, most promising first, that carries over between passes when incremental
+
+        batched keeps each pass going after it finds moves and plays everything
+        the pass came up with together, rather than the first constraint's moves
+
+        cache is a DerivationCache for the constraint pairs, it can be shared between solvers
+
+        results is a ResultCache, a level solved before with the same options is replayed from it
+
+        probe falls back to trying each color of each constrained cell when
+        nothing else finds moves, see probe. probe_depth is how many batches of
+        moves to follow an assumption for, probe_pairs how many pairs each of
+        its batches may try without a move and probe_pool a multiprocessing pool
+        to run the probes in
+
+        hypothetical assumes the moves rather than playing them, for probing
+
+        renderer is the Renderer the board is drawn with when DEBUG is over 10,
+        Level.dump's default one if it's None
+
+        pair_jobs over 1 shares out the constraint arithmetic of passes with more
+        than pair_chunk pairs among that many processes, see derive_pairs_pooled
+
+        prune leaves derived constraints out of the store when the ones already
+        in it say as much, see dominated, but not when incremental, where a
+        pruned constraint is never derived again. max_constraints caps the store, the
+        least promising derived constraints go when it's reached, see evict, but
+        not when scheduled, which never pairs up again what it has been through
+        """
         self.level = level
+        self.incremental = incremental
+        self.exhaustive = exhaustive or sat
+        self.sat = sat
+        self.check = check
+        self.scheduled = scheduled
+        self.batched = batched
+        self.cache = cache
+        self.results = results
+        self.probe = probe
+        self.probe_depth = probe_depth
+        self.probe_pairs = probe_pairs
+        self.probe_pool = probe_pool
+        self.hypothetical = hypothetical
+        self.renderer = renderer
+        self.pair_jobs = pair_jobs
+        self.pair_chunk = pair_chunk
+        self.prune = prune and not incremental
+        self.max_constraints = max_constraints if not scheduled else None
+        # whether to give up on the rules after stall_pairs pairs without a move
+        self.stall_limited = self.exhaustive or probe or hypothetical
+        # the batches of moves played and the bases of the constraints they came from
+        self.history = []
+        # what the results cache had for this level, if it had anything
+        self.cached = None
+        # whether moves stopped because the rules had nothing left, rather than a limit, timeout or cancel
+        self.exhausted = False
+        # when moves has to stop looking, see cancel
+        self.deadline = None
+        self.cancelled = False
+        self.queue = []
+        self.queued = itertools.count()
+        self.active = set()
+        self.stall_pairs = stall_pairs
+        self.on_stats = on_stats
+        self.stats = SolverStats()
+        self.all_constraints = None
+        self.played = []
+        self.touched = set()
+        self.pending = []
+
+    def cell_constraint(self, c):
+        res = self.level.get_constrant(c)
+        if not res:
+            return None, None
+        cs_type, cells, count, modifier = res
+        if modifier == APART:
+            return self.modifier_constraint(disjoint, c, cells, count, cs_type==BASIC)
+        elif modifier == TOGETHER:
+            return self.modifier_constraint(joint, c, cells, count, cs_type==BASIC)
+        else:
+            return basic(c, cells, count, self.level)
+
+    @phase("eval_modifier")
+    def modifier_constraint(self, rule, c, cells, count, loop):
+        return rule(c, cells, count, loop, self.level)
 
+    @phase("evaluate")
     def evaluate(self):
-        if DEBUG > 20: print "evaluate"
+        if DEBUG > 20: print("evaluate")
         self.all_constraints = dict()
         self.arith_new = set()
         self.arith_old = set()
@@ -581,135 +2119,524 @@ class Solver(object):
         self.adv_old = set()
         self.super_new = set()
         self.super_old = set()
+        self.cell_index = defaultdict(set)
+        self.played = []
+        self.touched = set()
+        self.pending = []
+        self.queue = []
+        self.active = set()
         self.new_stuff = True
         for c in self.level.all_cells():
-            res = self.level.get_constrant(c)
-            if res:
-                cs_type, cells, count, modifier = res
-                if modifier == APART:
-                    moves, cs = disjoint(c, cells, count, cs_type==BASIC, self.level)
-                elif modifier == TOGETHER:
-                    moves, cs = joint(c, cells, count, cs_type==BASIC, self.level)
-                else:
-                    moves, cs = basic(c, cells, count, self.level)
-                if moves:
+            moves, cs = self.cell_constraint(c)
+            if moves:
+                if not (self.incremental or self.batched):
                     return moves, cs
-                if cs:
-                    self.add_constraint(cs)
+                # update needs a complete store to work from, so keep going
+                self.pending.append((moves, cs))
+            if cs:
+                moves, cs = self.add_constraint(cs)
+                if moves:
+                    self.pending.append((moves, cs))
+        self.level_constraints = len(self.all_constraints)
+        return self.take_pending()
+
+    @phase("update")
+    def update(self):
+        """ fold the cells played since the last pass into the existing constraints """
+        if DEBUG > 20: print("update", len(self.played), len(self.touched))
+        changed = []
+        for cells in self.touched:
+            cs = self.remove_constraint(cells)
+            changed.append(cs.renormalize(self.level))
+        for c in self.played:
+            moves, cs = self.cell_constraint(c)
+            changed.append(cs)
+        self.played = []
+        self.touched = set()
+
+        for cs in changed:
+            if cs is None:
+                continue
+            moves = cs.get_moves(self.level)
+            if moves:
+                self.pending.append((moves, cs))
+            if moves or cs.interesting:
+                moves, cs = self.add_constraint(cs)
+                if moves:
+                    self.pending.append((moves, cs))
+        return self.take_pending()
+
+    def take_pending(self):
+        """ the next batch of moves we've found that still has something left to play """
+        if self.batched:
+            return self.take_batch()
+        while self.pending:
+            moves, cs = self.pending.pop(0)
+            moves = {(c, color) for c, color in moves if self.level.get_color(c) == UNKNOWN}
+            if moves:
+                return moves, cs
         return None, None
 
+    def take_batch(self):
+        """ all the pending moves as one batch, with a constraint over every cell they color """
+        colors = {}
+        bases = set()
+        debug = []
+        for moves, cs in self.pending:
+            moves = [(c, color) for c, color in moves if self.level.get_color(c) == UNKNOWN]
+            for c, color in moves:
+                if colors.setdefault(c, color) != color:
+                    raise Contradiction("conflicting moves for {0} from {1}".format(c, cs))
+            if moves:
+                bases.update(cs.bases)
+                debug.append(cs.debug)
+        self.pending = []
+        if not colors:
+            return None, None
+        blues = sum(1 for color in colors.values() if color == BLUE)
+        return set(colors.items()), Constraint(bases, cells_mask(colors), blues, blues, "|".join(debug))
+
+    def found(self, moves, cs):
+        """ whether a rule should stop at these moves, when batched they're kept for later instead """
+        if not self.batched:
+            return True
+        self.pending.append((moves, cs))
+        return False
+
     def add_constraint(self, cs):
+        """ store cs, returns any moves that merging it with what we already had produces """
+        if not cs.interesting:
+            # 0 to all of its cells blue, which says nothing
+            self.stats.discards += 1
+            return None, None
+        moves = None
         old = self.all_constraints.get(cs.cells)
         if old is not None:
-            old = self.all_constraints[cs.cells]
             cs = old.merge(cs)
             if cs is None:
-                return
-            self.arith_new.discard(old)
-            self.arith_old.discard(old)
-            self.adv_new.discard(old)
-            self.adv_old.discard(old)
-            self.super_new.discard(old)
-            self.super_old.discard(old)
-        if DEBUG > 30: print "new", cs
+                self.stats.discards += 1
+                return None, None
+            self.stats.merges += 1
+            moves = cs.get_moves(self.level)
+            self.arith_old.discard(cs.cells)
+            self.adv_old.discard(cs.cells)
+            self.super_old.discard(cs.cells)
+        else:
+            if self.prune and self.dominated(cs):
+                self.stats.pruned += 1
+                return None, None
+            for c in cs.cell_list:
+                self.cell_index[c].add(cs.cells)
+        if DEBUG > 30: print("new", cs)
+        self.stats.constraints += 1
+        if self.stats.current:
+            self.stats.phases[self.stats.current].constraints += 1
         self.all_constraints[cs.cells] = cs
-        self.arith_new.add(cs)
-        self.adv_new.add(cs)
-        self.super_new.add(cs)
+        self.arith_new.add(cs.cells)
+        self.adv_new.add(cs.cells)
+        self.super_new.add(cs.cells)
         self.new_stuff = True
+        if self.scheduled:
+            self.schedule(cs)
+        if self.max_constraints and len(self.all_constraints) > self.max_constraints:
+            self.evict()
+        self.stats.peak = max(self.stats.peak, len(self.all_constraints))
+        if moves:
+            return moves, cs
+        return None, None
 
-    def play(self, cell, color):
-        if DEBUG > 20: print "playing", cell, color
-        self.level.play(cell, color)
+    def list_lazy(self):
+        """
+        swap the constraints in the store with LazyPatterns for listed ones,
+        once the counts have taken the rules as far as they cheaply go.
+        Returns whether there were any
+        """
+        lazy = [cs for cs in self.all_constraints.values() if cs.lazy is not None]
+        for cs in lazy:
+            # skip any that a listed one pushed over max_constraints has evicted
+            if self.all_constraints.get(cs.cells) is not cs:
+                continue
+            self.remove_constraint(cs.cells)
+            moves, cs = self.add_constraint(cs.listed())
+            if moves:
+                self.pending.append((moves, cs))
+        return bool(lazy)
+
+    def remove_constraint(self, cells):
+        """ take the constraint over cells out of the store and everything that refers to it """
+        cs = self.all_constraints.pop(cells)
+        for s in [self.arith_new, self.arith_old, self.adv_new, self.adv_old, self.super_new, self.super_old,
+                  self.active]:
+            s.discard(cells)
+        for c in cs.cell_list:
+            if c in self.cell_index:
+                self.cell_index[c].discard(cells)
+        return cs
+
+    def dominated(self, cs):
+        """
+        whether the store already says everything cs does
+
+        Only one sided constraints are checked, at most max_count blue is
+        implied by a superset with no more than that and at least min_count by
+        a subset with no less. Constraints straight from the level and ones with
+        patterns are always kept.
+
+        It's a heuristic, cs could still have been paired into something the
+        superset or subset can't be. It's left alone when incremental, where a
+        pruned constraint isn't derived again once the store has moved on.
+        """
+        if cs.patterns is not None or len(cs.bases) == 1:
+            return False
+        if cs.min_count == 0:
+            # any superset must also contain cs's least shared cell
+            for cells in min((self.cell_index.get(c, ()) for c in cs.cell_list), key=len):
+                if is_strict_subset(cs.cells, cells) and self.all_constraints[cells].max_count <= cs.max_count:
+                    return True
+        elif cs.max_count == cs.size:
+            for cells in self.overlapping(cs):
+                if is_strict_subset(cells, cs.cells) and self.all_constraints[cells].min_count >= cs.min_count:
+                    return True
+        return False
+
+    def evict(self):
+        """
+        bring the store down to nine tenths of max_constraints, dropping the
+        derived constraints the scheduler would take last
+        """
+        excess = len(self.all_constraints) - self.max_constraints * 9 // 10
+        derived = (cs for cs in self.all_constraints.values() if len(cs.bases) > 1)
+        for cs in heapq.nlargest(excess, derived, key=constraint_score):
+            self.remove_constraint(cs.cells)
+            self.touched.discard(cs.cells)
+            self.stats.evicted += 1
+
+    def schedule(self, cs):
+        """ queue cs up to be paired with the constraints the scheduler has already been through """
+        self.active.discard(cs.cells)
+        # later constraints first among equals, they're the ones near the last moves
+        heapq.heappush(self.queue, (constraint_score(cs), -next(self.queued), cs))
 
+    def play(self, cell, color):
+        if DEBUG > 20: print("playing", cell, color)
+        if self.hypothetical:
+            self.level.assume(cell, color)
+        else:
+            self.level.play(cell, color)
+        self.stats.moves += 1
+        self.played.append(cell)
+        self.touched.update(self.cell_index.pop(cell, ()))
+
+    def overlapping(self, cs):
+        """ the cells of all the constraints that share at least one cell with cs """
+        res = set()
+        for c in cs.cell_list:
+            res.update(self.cell_index.get(c, ()))
+        return res
+
+    @phase("arithmetic")
     def arithmetic(self):
-        if DEBUG > 20: print "constraint arithmetic", len(self.all_constraints), len(self.arith_new)
+        if DEBUG > 20: print("constraint arithmetic", len(self.all_constraints), len(self.arith_new))
         new_constraints = set()
-        def inner(a, b):
-            for cs1 in a:
-                for cs2 in b:
-                    if cs2.cells < cs1.cells:
-                        moves, cs = subset(cs1, cs2, self.level)
-                        if moves:
-                            return moves, cs
-                        if cs:
-                            new_constraints.add(cs)
-            return None, None
-        moves, cs = inner(self.arith_new, self.arith_new)
-        if moves:
-            return moves, cs
-        moves, cs = inner(self.arith_old, self.arith_new)
-        if moves:
-            return moves, cs
-        moves, cs = inner(self.arith_new, self.arith_old)
-        if moves:
+        def pairs(a, b):
+            for cells2 in b:
+                # any superset of cs2 must also contain its least shared cell
+                for cells1 in min((self.cell_index[c] for c in self.all_constraints[cells2].cell_list), key=len):
+                    if cells1 in a and is_strict_subset(cells2, cells1):
+                        yield cells1, cells2
+        moves, cs = self.derive_pairs(subset, "arithmetic", itertools.chain(
+            pairs(self.arith_new, self.arith_new), pairs(self.arith_old, self.arith_new),
+            pairs(self.arith_new, self.arith_old)), new_constraints)
+        if moves or self.out_of_time():
+            # a pass cut short keeps its constraints new so it's done again
             return moves, cs
 
         self.arith_old.update(self.arith_new)
         self.arith_new = set()
 
-        for cs in new_constraints:
-            self.add_constraint(cs)
-        return None, None
+        self.add_derived(new_constraints)
+        return self.take_pending()
 
+    @phase("advanced_arithmetic")
     def advanced_arithmetic(self):
-        if DEBUG > 20: print "advanced arithmetic", len(self.all_constraints), len(self.adv_new)
+        if DEBUG > 20: print("advanced arithmetic", len(self.all_constraints), len(self.adv_new))
         new_constraints = set()
-        def inner2(a):
-            a = list(a)
-            for i, cs1 in enumerate(a):
-                for cs2 in a[i:]:
-                    moves, cs = intersection(cs1, cs2, self.level)
-                    if moves:
-                        return moves, cs
-                    if cs:
-                        new_constraints.add(cs)
-            return None, None
-        def inner(a, b):
-            for cs1 in a:
-                for cs2 in b:
-                    moves, cs = intersection(cs1, cs2, self.level)
-                    if moves:
-                        return moves, cs
-                    if cs:
-                        new_constraints.add(cs)
-            return None, None
-        moves, cs = inner2(self.adv_new)
-        if moves:
-            return moves, cs
-        moves, cs = inner(self.adv_new, self.adv_old)
-        if moves:
+        def pairs2(a):
+            done = set()
+            for cells1 in a:
+                done.add(cells1)
+                for cells2 in self.overlapping(self.all_constraints[cells1]) & a:
+                    if cells2 not in done:
+                        yield cells1, cells2
+        def pairs(a, b):
+            for cells1 in a:
+                for cells2 in self.overlapping(self.all_constraints[cells1]) & b:
+                    yield cells1, cells2
+        moves, cs = self.derive_pairs(intersection, "advanced_arithmetic", itertools.chain(
+            pairs2(self.adv_new), pairs(self.adv_new, self.adv_old)), new_constraints)
+        if moves or self.out_of_time():
             return moves, cs
 
         self.adv_old.update(self.adv_new)
         self.adv_new = set()
 
-        for cs in new_constraints:
-            self.add_constraint(cs)
+        self.add_derived(new_constraints)
+        return self.take_pending()
+
+    def add_derived(self, constraints):
+        """ add_constraint each of constraints, keeping any moves for take_pending, until out of time """
+        for cs in constraints:
+            if self.out_of_time():
+                break
+            moves, cs = self.add_constraint(cs)
+            if moves:
+                self.pending.append((moves, cs))
+
+    def derive_pairs(self, rule, phase_name, pairs, new_constraints):
+        """
+        rule for each (cells1, cells2) of pairs in turn, returns the first moves
+        found and adds the constraints it comes up with to new_constraints.
+        Stops early when out of time
+        """
+        if self.pair_jobs > 1:
+            pairs = list(pairs)
+            if len(pairs) > self.pair_chunk:
+                return self.derive_pairs_pooled(rule, phase_name, pairs, new_constraints)
+        stats = self.stats.phases[phase_name]
+        for cells1, cells2 in pairs:
+            if self.out_of_time():
+                break
+            stats.pairs += 1
+            moves, cs = self.derive(rule, self.all_constraints[cells1], self.all_constraints[cells2])
+            if moves and self.found(moves, cs):
+                return moves, cs
+            if cs:
+                new_constraints.add(cs)
         return None, None
 
+    def derive_pairs_pooled(self, rule, phase_name, pairs, new_constraints):
+        """
+        derive_pairs across the shared pool of pair_jobs processes
+
+        The pairs go out in chunks of pair_chunk, a wave of one chunk per
+        process at a time so no more than a wave is wasted once there are
+        moves. The results are gone through in the order of the pairs, so
+        this finds the same moves and constraints as going through them here.
+        """
+        pool = shared_pool(self.pair_jobs)
+        debug = DerivationCache.DEBUG[rule.__name__]
+        stats = self.stats.phases[phase_name]
+        chunks = [pairs[i:i + self.pair_chunk] for i in range(0, len(pairs), self.pair_chunk)]
+        for start in range(0, len(chunks), self.pair_jobs):
+            if self.out_of_time():
+                break
+            wave = chunks[start:start + self.pair_jobs]
+            tasks = [(rule.__name__, pack_pairs([self.all_constraints[cells] for pair in chunk for cells in pair]))
+                     for chunk in wave]
+            for chunk, results in zip(wave, pool.map(_derive_packed, tasks)):
+                stats.pairs += len(chunk)
+                for k, moves, packed in results:
+                    cs = None
+                    if packed is not None:
+                        cs1 = self.all_constraints[chunk[k][0]]
+                        cs2 = self.all_constraints[chunk[k][1]]
+                        cs = Constraint(cs1.bases | cs2.bases, *packed[:3],
+                                        debug=debug.format(cs1.debug, cs2.debug), indicies=packed[3], patterns=packed[4])
+                    if moves and self.found(moves, cs):
+                        return moves, cs
+                    if cs:
+                        new_constraints.add(cs)
+        return None, None
+
+    @phase("global_constraint")
     def global_constraint(self):
-        if DEBUG > 20: print "global constraint"
+        if DEBUG > 20: print("global constraint")
         count = self.level.total_count()
         cells = self.level.all_cells()
         moves, cs = basic("global", cells, count, self.level)
-        if moves:
+        if cs and not moves:
+            moves, cs = self.add_constraint(cs)
+        if moves and self.found(moves, cs):
             return moves, cs
-        if cs:
-            self.add_constraint(cs)
+        return self.take_pending()
+
+    @phase("scheduled_pairs")
+    def scheduled_pairs(self, stall_at=None):
+        """
+        take the most promising constraints off the queue and pair each one with
+        the overlapping constraints already taken off it, until some moves turn
+        up or pairs_tried reaches stall_at
+        """
+        if DEBUG > 20: print("scheduled pairs", len(self.all_constraints), len(self.queue))
+        stats = self.stats.phases["scheduled_pairs"]
+        # when batched this still stops once some moves turn up, draining the
+        # whole queue derives far more than the moves are worth
+        while self.queue and not self.pending and not self.out_of_time():
+            if stall_at is not None and self.pairs_tried() >= stall_at:
+                if DEBUG > 20: print("stalled")
+                break
+            entry = heapq.heappop(self.queue)
+            cs1 = entry[2]
+            # skip constraints that have since been replaced or played
+            if self.all_constraints.get(cs1.cells) is not cs1:
+                continue
+            new_constraints = []
+            for cells in self.overlapping(cs1) & self.active:
+                if self.out_of_time():
+                    # back on the queue to be paired in full next time
+                    heapq.heappush(self.queue, entry)
+                    return self.take_pending()
+                cs2 = self.all_constraints[cells]
+                pairs = []
+                if is_strict_subset(cells, cs1.cells):
+                    pairs.append(self.derive(subset, cs1, cs2))
+                elif is_strict_subset(cs1.cells, cells):
+                    pairs.append(self.derive(subset, cs2, cs1))
+                if can_intersect(cs1, cs2):
+                    pairs.append(self.derive(intersection, cs1, cs2))
+                stats.pairs += len(pairs)
+                for moves, cs in pairs:
+                    if moves:
+                        self.pending.append((moves, cs))
+                    if cs:
+                        new_constraints.append(cs)
+            self.active.add(cs1.cells)
+            self.add_derived(new_constraints)
+        return self.take_pending()
+
+    def derive(self, rule, cs1, cs2):
+        # plain counts are quicker to work out again than to look up
+        if self.cache is None or (cs1.patterns is None and cs2.patterns is None):
+            return rule(cs1, cs2, self.level)
+        hits = self.cache.hits
+        res = self.cache.derive(rule, cs1, cs2, self.level)
+        if self.cache.hits > hits:
+            self.stats.cache_hits += 1
+        else:
+            self.stats.cache_misses += 1
+        return res
+
+    def pairs_tried(self):
+        return sum(self.stats.phases[name].pairs for name in ["arithmetic", "advanced_arithmetic", "scheduled_pairs"])
+
+    @phase("component_search")
+    def component_search(self):
+        if DEBUG > 20: print("component search")
+        moves, bases = component_moves(self.level)
+        if not moves:
+            return None, None
+        blues = sum(1 for _, color in moves if color == BLUE)
+        cs = Constraint(bases, cells_mask(c for c, _ in moves), blues, blues, "components")
+        return moves, cs
+
+    @phase("sat_search")
+    def sat_search(self):
+        if DEBUG > 20: print("sat search")
+        moves, bases = sat_moves(self.level)
+        if not moves:
+            return None, None
+        blues = sum(1 for _, color in moves if color == BLUE)
+        cs = Constraint(bases, cells_mask(c for c, _ in moves), blues, blues, "sat")
+        return moves, cs
+
+    @phase("sat_check")
+    def sat_check(self, moves, cs):
+        wrong = sat_check(self.level, moves)
+        if wrong:
+            raise UnprovenMoves("moves not implied by the level {0} from {1}".format(sorted(wrong), cs))
         return None, None
 
     def _solve(self):
-        moves, cs = self.evaluate()
+        moves, cs = self._apply_rules()
+        if moves or self.out_of_time():
+            return moves, cs
+        if self.exhaustive:
+            if self.sat:
+                moves, cs = self.sat_search()
+            else:
+                moves, cs = self.component_search()
+        if not moves and self.probe and not self.out_of_time():
+            moves, cs = self.probe_search()
+        return moves, cs
+
+    @phase("probe")
+    def probe_search(self):
+        """ the other color for every cell where assuming one color runs into a contradiction """
+        if DEBUG > 20: print("probe")
+        # the most constrained cells are the likeliest to go wrong quickly
+        counts = defaultdict(int)
+        for _, cells, _, _, _ in level_constraints(self.level):
+            for c in cells:
+                counts[c] += 1
+        cells = sorted(counts, key=lambda c: (-counts[c], c))
+        tasks = [(self.level, c, color, self.probe_depth, self.probe_pairs) for c in cells for color in (BLUE, BLACK)]
+        self.stats.phases["probe"].pairs += len(tasks)
+
+        if self.probe_pool is not None:
+            # everything at once, stopping early would leave the pool busy with the rest
+            results = self.probe_pool.map(_probe, tasks, chunksize=max(1, len(tasks) // 64))
+        else:
+            # one at a time, stopping at the first contradiction
+            results = (_probe(task) for task in tasks)
+        moves = set()
+        for (_, c, color, _, _), contradiction in zip(tasks, results):
+            if contradiction:
+                moves.add((c, BLACK if color == BLUE else BLUE))
+                if self.probe_pool is None:
+                    break
+        if not moves:
+            return None, None
+        cells = [c for c, _ in moves]
+        if len(set(cells)) < len(cells):
+            raise Contradiction("both colors of a cell lead to contradictions")
+        blues = sum(1 for _, color in moves if color == BLUE)
+        return moves, Constraint(cells, cells_mask(cells), blues, blues, "probe")
+
+    def _apply_rules(self):
+        if self.incremental and self.all_constraints is not None and \
+                len(self.all_constraints) <= REBUILD_FACTOR * self.level_constraints:
+            moves, cs = self.update()
+        else:
+            moves, cs = self.evaluate()
         if moves:
             return moves, cs
 
+        start_pairs = self.pairs_tried()
+        if self.scheduled:
+            # the scheduler intersects from the start, which bare counts would run away with
+            self.list_lazy()
+            stall_at = start_pairs + self.stall_pairs if self.stall_limited else None
+            while True:
+                moves, cs = self.scheduled_pairs(stall_at)
+                if moves:
+                    return moves, cs
+                if stall_at is not None and self.pairs_tried() >= stall_at or self.out_of_time():
+                    return None, None
+                # the global constraint only queues anything when it has tightened
+                moves, cs = self.global_constraint()
+                if moves:
+                    return moves, cs
+                if not self.queue:
+                    return None, None
+
         while self.new_stuff:
+            if self.stall_limited and self.pairs_tried() - start_pairs > self.stall_pairs:
+                if DEBUG > 20: print("stalled")
+                break
+            if self.out_of_time():
+                break
             self.new_stuff = False
             moves, cs = self.arithmetic()
             if moves:
                 return moves, cs
 
+            if not self.new_stuff and self.list_lazy():
+                # intersections of bare counts run away, so the lines are listed first
+                moves, cs = self.take_pending()
+                if moves:
+                    return moves, cs
+                continue
+
             if not self.new_stuff:
                 moves, cs = self.advanced_arithmetic()
                 if moves:
@@ -723,43 +2650,685 @@ class Solver(object):
 
         return None, None
 
-    def solve(self):
-        if DEBUG > 10: self.level.dump()
-        while True:
-            moves, cs = self._solve()
-            if not moves:
-                break
-            if DEBUG > 25: print "play", cs
+    def options(self):
+        """ the settings that change what moves we make, results are only reused between solvers that agree on these """
+        return {
+            "incremental": self.incremental, "exhaustive": self.exhaustive, "sat": self.sat,
+            "scheduled": self.scheduled, "batched": self.batched, "stall_pairs": self.stall_pairs,
+            "probe": self.probe and (self.probe_depth, self.probe_pairs),
+            "prune": self.prune, "max_constraints": self.max_constraints,
+        }
+
+    def solve(self, limit=None):
+        """ play moves until we run out or have played limit batches, returns whether the level is done """
+        if DEBUG > 10 and not self.hypothetical: self.level.dump(renderer=self.renderer)
+        if self.results is not None:
+            digest = self.level.digest()
+            self.cached = self.results.get(digest, self.options())
+            if self.cached is not None:
+                return self.replay(self.cached["history"])
+
+        start = time.time()
+        for _ in self.moves(limit):
+            pass
+
+        done = self.level.done()
+        # a run cut short would replay as the whole solve
+        if self.results is not None and self.exhausted:
+            self.results.put(digest, self.options(), done, self.history, time.time() - start)
+        return done
+
+    def moves(self, limit=None, timeout=None):
+        """
+        generator of the (moves, constraint) batches as they are found, the
+        constraint's bases and debug say why. Each batch is played when the
+        next one is asked for, so closing the generator after the first leaves
+        the level as it was, though the solver can't be used again after that.
+        Stops after limit batches, timeout seconds or a call to cancel
+        """
+        # set here rather than in the generator so a cancel before the first batch counts
+        self.cancelled = False
+        self.exhausted = False
+        self.deadline = time.time() + timeout if timeout is not None else None
+        return self._moves(limit)
+
+    def _moves(self, limit):
+        try:
+            while (limit is None or len(self.history) < limit) and not self.out_of_time():
+                moves, cs = self._solve()
+                if not moves:
+                    self.exhausted = not self.out_of_time()
+                    return
+                if DEBUG > 25: print("play", cs)
+                if self.check:
+                    self.sat_check(moves, cs)
+                yield moves, cs
+                for cell, color in moves:
+                    self.play(cell, color)
+                self.history.append((sorted(moves), sorted_bases(cs.bases)))
+                if DEBUG > 10 and not self.hypothetical: self.level.dump(cs.bases, [c for c,_ in moves], self.renderer)
+        finally:
+            self.deadline = None
+
+    def hint(self, timeout=None):
+        """ the first (moves, constraint) batch without playing it, or None, None if there isn't one in time """
+        batches = self.moves(timeout=timeout)
+        try:
+            return next(batches, (None, None))
+        finally:
+            batches.close()
+
+    def cancel(self):
+        """ stop moves at the end of the pass it is in, safe to call from another thread """
+        self.cancelled = True
+
+    def out_of_time(self):
+        return self.cancelled or (self.deadline is not None and time.time() > self.deadline)
+
+    def replay(self, history):
+        """ play the moves from an earlier solve, Level.play checks each of them is right """
+        for moves, bases in history:
             for cell, color in moves:
-                self.play(cell, color)
-            if DEBUG > 10: self.level.dump(cs.bases, [c for c,_ in moves])
+                self.level.play(cell, color)
+                self.stats.moves += 1
+            self.history.append((moves, bases))
+            if DEBUG > 10: self.level.dump(bases, [c for c,_ in moves], self.renderer)
+        return self.level.done()
+
 
-        return self.level.done
+def sorted_bases(bases):
+    """ the names like "global" and then the cells """
+    return sorted(bases, key=lambda base: (isinstance(base, tuple), base))
+
+
+def probe(level, cell, color, depth=20, stall_pairs=1000):
+    """
+    whether assuming cell is color runs into a Contradiction within depth
+    batches of moves, leaves level as it was
+    """
+    state = level.snapshot()
+    try:
+        level.assume(cell, color)
+        Solver(level, hypothetical=True, stall_pairs=stall_pairs).solve(depth)
+        return False
+    except Contradiction:
+        return True
+    finally:
+        level.restore(state)
+
+
+def _probe(args):
+    return probe(*args)
+
+
+def hexagon(radius, centre=(16, 16)):
+    """ the cells of a hexagonal board, radius cells out from the centre one """
+    cx, cy = centre
+    cells = [(cx + dx, cy + dy) for dx in range(-radius, radius + 1)
+             for dy in range(abs(dx) - 2 * radius, 2 * radius - abs(dx) + 1, 2)]
+    if not all(on_grid(c) for c in cells):
+        raise ValueError("a hexagon of radius {0} around {1} doesn't fit the grid".format(radius, centre))
+    return cells
+
+
+def deducible(level, timeout=None, **solver_args):
+    """ whether the solver can finish a copy of level, which also means its solution is the only one """
+    work = level.copy()
+    for _ in Solver(work, **solver_args).moves(timeout=timeout):
+        pass
+    return work.done()
+
+
+def random_board(shape, rng, blues=0.4, numbers=0.8, areas=0.1, lines=0.3, modifiers=0.2):
+    """
+    The 33 board lines of a level on the shape's cells with random colors and
+    markers, none of them revealed
+
+    blues is the chance of a cell being blue, numbers of a black cell showing
+    its count, areas of a blue cell showing its community's count, lines of an
+    empty cell next to the board numbering the line through it and modifiers
+    of a count of at least 2 showing whether its blues are together or apart
+    """
+    shape = set(shape)
+    board = {c: ("x" if rng.random() < blues else "o") for c in shape}
+
+    def mark(c, t, wrap):
+        cells = geometry()[t][c]
+        if not wrap:
+            cells = [n for n in cells if n in board]
+        colors = [EMPTY if n not in board else BLUE if board[n] == "x" else BLACK for n in cells]
+        count = colors.count(BLUE)
+        if count < 2 or rng.random() >= modifiers:
+            return "+"
+        return "c" if next(blue_runs(colors, count, wrap), None) is not None else "n"
+
+    texts = {}
+    for c in shape:
+        if board[c] == "o":
+            texts[c] = "o" + (mark(c, BASIC, True) if rng.random() < numbers else ".")
+        else:
+            texts[c] = "x" + ("+" if rng.random() < areas else ".")
+    kinds = {VERTICAL: "|", LEFT_DIAG: "/", RIGHT_DIAG: "\\"}
+    for c in sorted(set(GRID) - shape):
+        # a number has to be just before the board along its line
+        types = [t for t, step in sorted(LINE_STEPS.items()) if add(c, step) in shape]
+        if types and rng.random() < lines:
+            t = rng.choice(types)
+            texts[c] = kinds[t] + mark(c, t, False)
+    return ["".join(texts.get((x, y), "..") for x in range(33)) for y in range(33)]
+
+
+def generate(shape, rng=None, revealed=0.1, timeout=None, texts=("Generated", "", "", ""), **solver_args):
+    """
+    A random level on the shape's cells that the solver can finish, None if
+    that takes longer than timeout or a fresh solver can't finish it after all
+
+    It starts with a revealed fraction of the cells showing, and whenever the
+    solver stalls reveals one of the cells it couldn't get to and carries on
+    with the same solver from where it stalled, rather than starting the board
+    again. Exhaustive solvers with a small stall_pairs are much the quickest
+    at this. rng is a random.Random, see random_board for the other settings,
+    which can be passed in with the solver's
+    """
+    import random
+    rng = rng or random.Random()
+    board_args = {k: solver_args.pop(k) for k in ["blues", "numbers", "areas", "lines", "modifiers"] if k in solver_args}
+    level = Level.from_lines(["Hexcells level v1"] + list(texts) + random_board(shape, rng, **board_args))
+    shape = sorted(shape)
+    for c in rng.sample(shape, int(len(shape) * revealed)):
+        level.play(c, BLUE if level.cell(c).true_value else BLACK)
+
+    deadline = time.time() + timeout if timeout is not None else None
+    work = level.copy()
+    solver = Solver(work, **solver_args)
+    while True:
+        left = None if deadline is None else deadline - time.time()
+        if left is not None and left <= 0:
+            return None
+        for _ in solver.moves(timeout=left):
+            pass
+        unknown = [c for c in shape if work.get_color(c) == UNKNOWN]
+        if not unknown:
+            break
+        c = rng.choice(unknown)
+        color = BLUE if level.cell(c).true_value else BLACK
+        level.play(c, color)
+        solver.play(c, color)
+
+    # check it the way it'll be solved, from its text with nothing carried over
+    left = None if deadline is None else deadline - time.time()
+    if deducible(Level(level.text()), timeout=left, **solver_args):
+        return level
+    return None
+
+
+class ResultCache(object):
+    """
+    Solves kept in SQLite, keyed on Level.digest, the solver options and
+    SOLVER_VERSION. Results from other versions are deleted when it's opened.
+
+    history is the moves played, batch by batch, each with the bases of the
+    constraint that justified it. Bases are cells or names like "global".
+    """
+    def __init__(self, fname):
+        import sqlite3
+        self.db = sqlite3.connect(fname, timeout=60)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results (digest TEXT, version INTEGER, options TEXT, "
+                "solved INTEGER, history TEXT, time REAL, PRIMARY KEY (digest, version, options))")
+            self.db.execute("DELETE FROM results WHERE version != ?", (SOLVER_VERSION,))
+
+    def get(self, digest, options):
+        """ {"solved", "history", "time"} for the level, or None if we haven't got it """
+        import json
+        row = self.db.execute(
+            "SELECT solved, history, time FROM results WHERE digest = ? AND version = ? AND options = ?",
+            (digest, SOLVER_VERSION, json.dumps(options, sort_keys=True))).fetchone()
+        if row is None:
+            return None
+        solved, history, solve_time = row
+        history = [
+            ([(tuple(cell), color) for cell, color in moves], [tuple(b) if isinstance(b, list) else b for b in bases])
+            for moves, bases in json.loads(history)
+        ]
+        return {"solved": bool(solved), "history": history, "time": solve_time}
+
+    def put(self, digest, options, solved, history, solve_time):
+        import json
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, SOLVER_VERSION, json.dumps(options, sort_keys=True), int(solved),
+                 json.dumps(history), solve_time))
+
+
+# one connection per process
+_results = {}
+
+
+def shared_results(fname):
+    if fname not in _results:
+        _results[fname] = ResultCache(fname)
+    return _results[fname]
+
+
+class Timeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise Timeout()
+
+
+LEVEL_FILES = (".hexcells", ".hexcells.gz", ".zip", ".hxb")
+
+ARCHIVE_MAGIC = b"HXB1"
+
+
+def level_name(path, i):
+    """ levels after the first in a file are told apart by their position """
+    return path if i == 0 else "{0}#{1}".format(path, i)
+
+
+def parse_levels(f):
+    """ the Levels in a stream of *.hexcells text, any number of them one after another """
+    lines = []
+    for line in f:
+        line = line.decode("utf-8").rstrip("\r\n")
+        if not lines and line != "Hexcells level v1":
+            # blank lines between levels
+            continue
+        lines.append(line)
+        if len(lines) == 38:
+            yield Level.from_lines(lines)
+            lines = []
+    assert not lines, "incomplete level at the end"
+
+
+def read_levels(paths):
+    """
+    (name, Level) for all the levels in paths, read as they're asked for
+
+    paths can be *.hexcells files holding any number of levels, gzipped ones,
+    zip files of them, *.hxb archives from write_archive, or directories of
+    any of those
+    """
+    import gzip
+    import zipfile
+    for path in paths:
+        if os.path.isdir(path):
+            fnames = [os.path.join(path, fname) for fname in sorted(os.listdir(path)) if fname.endswith(LEVEL_FILES)]
+            for res in read_levels(fnames):
+                yield res
+        elif path.endswith(".hxb"):
+            archive = LevelArchive(path)
+            try:
+                for i in range(len(archive)):
+                    yield level_name(path, i), archive[i]
+            finally:
+                # the generator may be closed part way through
+                archive.close()
+        elif path.endswith(".zip"):
+            with zipfile.ZipFile(path) as z:
+                for info in z.infolist():
+                    if info.filename.endswith("/"):
+                        continue
+                    member = "{0}/{1}".format(path, info.filename)
+                    for i, level in enumerate(parse_levels(z.open(info))):
+                        yield level_name(member, i), level
+        else:
+            f = gzip.open(path) if path.endswith(".gz") else open(path, "rb")
+            with f:
+                for i, level in enumerate(parse_levels(f)):
+                    yield level_name(path, i), level
+
+
+def write_archive(levels, f):
+    """
+    Write the levels to f as a *.hxb archive, returns how many there were
+
+    The header is the magic and where the index is, then each level is its
+    packed board followed by its four texts, each a 2 byte length and UTF-8.
+    The index at the end is the number of levels and then where each starts.
+    Numbers are little endian.
+    """
+    f.write(struct.pack("<4sQ", ARCHIVE_MAGIC, 0))
+    offsets = []
+    for level in levels:
+        offsets.append(f.tell())
+        f.write(pack_board(level._kinds, level._marks))
+        for text in [level.title, level.author, level.custom_text_1, level.custom_text_2]:
+            text = text.encode("utf-8")
+            f.write(struct.pack("<H", len(text)) + text)
+    index = f.tell()
+    f.write(struct.pack("<Q", len(offsets)))
+    f.write(struct.pack("<{0}Q".format(len(offsets)), *offsets))
+    f.seek(0)
+    f.write(struct.pack("<4sQ", ARCHIVE_MAGIC, index))
+    return len(offsets)
+
+
+class LevelArchive(object):
+    """ random access to the levels of a *.hxb archive by index, mapped rather than read """
+    def __init__(self, fname):
+        import mmap
+        self._file = open(fname, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._index = struct.unpack_from("<4sQ", self._map, 0)
+        assert magic == ARCHIVE_MAGIC, "not a level archive"
+        self._count, = struct.unpack_from("<Q", self._map, self._index)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        offset, = struct.unpack_from("<Q", self._map, self._index + 8 + 8 * i)
+        board = self._map[offset:offset + BOARD_BYTES]
+        offset += BOARD_BYTES
+        texts = []
+        for _ in range(4):
+            size, = struct.unpack_from("<H", self._map, offset)
+            texts.append(self._map[offset + 2:offset + 2 + size].decode("utf-8"))
+            offset += 2 + size
+        return Level.from_board(texts, board)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def solve_level(name, level, timeout=None, cache_size=None, results=None, **kwargs):
+    """
+    solve a level and summarise how it went in a json friendly dict, kwargs go to the Solver
+
+    cache_size gives the solver this process's shared DerivationCache of that size,
+    results is the file name of a ResultCache for it
+    """
+    import signal
+    result = {"file": name}
+    start = time.time()
+    solver = None
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    try:
+        result["title"] = level.title
+        result["author"] = level.author
+        if cache_size:
+            kwargs["cache"] = shared_cache(cache_size)
+        if results:
+            kwargs["results"] = shared_results(results)
+        solver = Solver(level, **kwargs)
+        result["solved"] = solver.solve()
+    except Timeout:
+        result["solved"] = False
+        result["error"] = "timeout"
+    except Exception as e:
+        result["solved"] = False
+        result["error"] = "{0}: {1}".format(e.__class__.__name__, e)
+    finally:
+        if timeout:
+            signal.alarm(0)
+    result["time"] = time.time() - start
+    if solver is not None:
+        result["moves"] = solver.stats.moves
+        result["constraints"] = solver.stats.constraints
+        result["arithmetic_pairs"] = solver.stats.phases["arithmetic"].pairs
+        result["advanced_pairs"] = solver.stats.phases["advanced_arithmetic"].pairs
+        result["stats"] = solver.stats.as_dict()
+        if solver.cached is not None:
+            result["cached"] = True
+            result["solve_time"] = solver.cached["time"]
+    return result
+
+
+def _solve_level(args):
+    name, level, kwargs = args
+    return solve_level(name, level, **kwargs)
+
+
+def batch(levels, jobs, report, **kwargs):
+    """
+    solve the (name, level)s across a pool of jobs processes, returns whether they were all solved
+
+    levels is consumed as the pool gets through them and the boards are
+    parsed in the workers, so it can be a reader over a big archive
+    """
+    import json
+    import multiprocessing
+    tasks = ((name, level, kwargs) for name, level in levels)
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(_solve_level, tasks)
+    else:
+        pool = None
+        results = (_solve_level(task) for task in tasks)
+
+    all_solved = True
+    for result in results:
+        report.write(json.dumps(result, sort_keys=True) + "\n")
+        report.flush()
+        all_solved &= result["solved"]
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return all_solved
+
+
+# slowdowns against a benchmark baseline smaller than this many seconds are
+# timer noise on the tiny levels however large they are in percent
+BENCHMARK_NOISE = 0.05
+
+
+def benchmark(levels, warmup, repeat, baseline=None, tolerance=10, timeout=None, cache_size=None, **kwargs):
+    """
+    Time the solver over the (name, level)s, print a per level and total table
+    and return the results and whether anything regressed against the baseline
+
+    Every run gets a DerivationCache of cache_size of its own, so warmup runs
+    don't fill it in for the timed ones
+    """
+    results = {}
+    for name, level in levels:
+        name = os.path.basename(name)
+        runs = []
+        for i in range(warmup + repeat):
+            if cache_size:
+                kwargs["cache"] = DerivationCache(cache_size)
+            result = solve_level(name, level.copy(), timeout=timeout, **kwargs)
+            if i >= warmup:
+                runs.append(result)
+            if result.get("error"):
+                # no point waiting on a timeout again
+                runs = [result]
+                break
+        times = [r["time"] for r in runs]
+        result = {
+            "solved": runs[-1]["solved"],
+            "error": runs[-1].get("error"),
+            "time": min(times),
+            "mean_time": sum(times) / len(times),
+            "constraints": runs[-1].get("constraints", 0),
+            "arithmetic_pairs": runs[-1].get("arithmetic_pairs", 0),
+            "advanced_pairs": runs[-1].get("advanced_pairs", 0),
+        }
+        results[name] = result
+
+    row = "{0:45} {1:>6} {2:>9} {3:>9} {4:>8} {5:>10} {6:>10} {7:>8}"
+    print(row.format("level", "solved", "time", "mean", "cons", "arith", "advanced", "baseline"))
+    regressed = False
+    totals = defaultdict(int)
+    for name in sorted(results):
+        result = results[name]
+        for key in ["time", "mean_time", "constraints", "arithmetic_pairs", "advanced_pairs"]:
+            totals[key] += result[key]
+        totals["solved"] += result["solved"]
+        compare = ""
+        if baseline and name in baseline:
+            old = baseline[name]
+            change = (result["time"] - old["time"]) / old["time"] * 100 if old["time"] else 0
+            compare = "{0:+.0f}%".format(change)
+            slower = change > tolerance and result["time"] - old["time"] > BENCHMARK_NOISE
+            if slower or (old["solved"] and not result["solved"]):
+                compare += " !!"
+                regressed = True
+        print(row.format(
+            name, str(result.get("error") or result["solved"]), "{0:.3f}".format(result["time"]),
+            "{0:.3f}".format(result["mean_time"]), result["constraints"],
+            result["arithmetic_pairs"], result["advanced_pairs"], compare))
+    print(row.format(
+        "total", "{0}/{1}".format(totals["solved"], len(results)), "{0:.3f}".format(totals["time"]),
+        "{0:.3f}".format(totals["mean_time"]), totals["constraints"],
+        totals["arithmetic_pairs"], totals["advanced_pairs"], ""))
+    return results, regressed
 
 
 def main():
-    global DEBUG
+    global DEBUG, NUMPY
+    import docopt
+    import json
+    import multiprocessing
     try:
         arguments = docopt.docopt(__doc__)
     except docopt.DocoptExit:
-        print __doc__
+        print(__doc__)
         sys.exit(1)
     DEBUG = int(arguments["--debug"])
     if arguments.get("--show-moves"):
         DEBUG = 15
-
-    for fname in arguments["HEXCELLS_FILES"]:
-        level = Level(open(fname).read())
-
+    if arguments["--numpy"]:
+        try:
+            load_numpy()
+        except ImportError:
+            print("--numpy needs numpy installed")
+            sys.exit(1)
+        NUMPY = True
+
+    paths = arguments["HEXCELLS_FILES"]
+    if arguments["benchmark"] and not paths:
+        here = os.path.dirname(os.path.abspath(__file__))
+        paths = [os.path.join(here, "solved"), os.path.join(here, "unsolved")]
+    levels = read_levels(paths)
+    solver_args = dict(incremental=arguments["--incremental"], exhaustive=arguments["--exhaustive"],
+                       sat=arguments["--sat"], check=arguments["--check"],
+                       scheduled=arguments["--scheduled"], batched=arguments["--batched"],
+                       probe=arguments["--probe"], probe_depth=int(arguments["--probe-depth"]),
+                       prune=arguments["--prune"], max_constraints=int(arguments["--max-constraints"]) if arguments["--max-constraints"] else None)
+    if arguments["--prune"] and arguments["--incremental"]:
+        # pruned constraints would never be derived again, darman-tutorial_12 takes 10 times as long
+        print("--prune can't be used with --incremental")
+        sys.exit(1)
+    if arguments["--max-constraints"] and arguments["--scheduled"]:
+        # evicted constraints would never be derived again, darman-tutorial_12 stalls after two moves
+        print("--max-constraints can't be used with --scheduled")
+        sys.exit(1)
+    for option in ["--probe-jobs", "--pair-jobs"]:
+        if arguments[option] and arguments["--jobs"]:
+            # the batch workers are daemons and can't have pools of their own
+            print(option, "can't be used with --jobs")
+            sys.exit(1)
+    if arguments["--probe-jobs"]:
+        solver_args["probe_pool"] = multiprocessing.Pool(int(arguments["--probe-jobs"]))
+    if arguments["--pair-jobs"]:
+        solver_args["pair_jobs"] = int(arguments["--pair-jobs"])
+    cache_size = int(arguments["--cache"] or 0)
+    results = arguments["--results"]
+
+    if arguments["benchmark"]:
+        if results:
+            # the timed runs would only be replays
+            print("--results can't be used with benchmark")
+            sys.exit(1)
+        baseline = None
+        if arguments["--baseline"]:
+            with open(arguments["--baseline"]) as f:
+                baseline = json.load(f)
+        results, regressed = benchmark(
+            levels, int(arguments["--warmup"]), int(arguments["--repeat"]), baseline=baseline,
+            tolerance=float(arguments["--tolerance"]), timeout=int(arguments["--timeout"] or 60),
+            cache_size=cache_size, **solver_args)
+        if arguments["--save-baseline"]:
+            with open(arguments["--save-baseline"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if regressed:
+            sys.exit(1)
+        return
+
+    if arguments["--jobs"]:
+        report = open(arguments["--report"], "w") if arguments["--report"] else sys.stdout
+        timeout = int(arguments["--timeout"]) if arguments["--timeout"] else None
+        all_solved = batch(levels, int(arguments["--jobs"]), report,
+                           timeout=timeout, cache_size=cache_size, results=results, **solver_args)
+        if not all_solved:
+            sys.exit(1)
+        return
+
+    if arguments["pack"]:
+        with open(arguments["ARCHIVE"], "wb") as f:
+            count = write_archive((level for _, level in levels), f)
+        print("Packed", count, "levels into", arguments["ARCHIVE"])
+        return
+
+    if arguments["generate"]:
+        import random
+        rng = random.Random(int(arguments["--seed"]) if arguments["--seed"] else None)
+        radius = int(arguments["--radius"])
+        if not 1 <= radius <= 8:
+            # the centre is 16 cells from the edges of the grid, which is 8 hexes up or down
+            print("--radius must be between 1 and 8")
+            sys.exit(1)
+        shape = hexagon(radius)
+        timeout = int(arguments["--timeout"]) if arguments["--timeout"] else None
         start = time.time()
+        count = tries = 0
+        with open(arguments["OUTPUT"], "w") as f:
+            while count < int(arguments["--count"]):
+                tries += 1
+                # the exact search is what keeps this quick, the arithmetic stalls a lot on random boards
+                level = generate(shape, rng, timeout=timeout, **dict(solver_args, exhaustive=True, stall_pairs=0))
+                if level is not None:
+                    f.write(level.text() + "\n")
+                    count += 1
+        print("Generated", count, "levels into", arguments["OUTPUT"], "from", tries, "tries in", time.time() - start)
+        return
+
+    renderer = Renderer(open(arguments["--frames"], "w") if arguments["--frames"] else None, arguments["--plain"])
+
+    if arguments["hint"]:
+        for name, level in levels:
+            moves, cs = Solver(level, renderer=renderer, **solver_args).hint(timeout=int(arguments["--timeout"] or 60))
+            level.dump(cs and cs.bases, moves and [c for c, _ in moves], renderer)
+            print("File:", name)
+            if moves:
+                print("Hint:", " ".join("{0} {1},".format(c, "blue" if color == BLUE else "black") for c, color in sorted(moves)).rstrip(","))
+                print("From:", cs.debug)
+            else:
+                print("Hint: none")
+        return
 
-        Solver(level).solve()
-
+    for name, level in levels:
+        start = time.time()
 
-        level.dump()
-        print "File:", fname
-        print "Done:", level.done()
-        print "Time:", time.time() - start
+        cache = shared_cache(cache_size) if cache_size else None
+        solver = Solver(level, cache=cache, results=shared_results(results) if results else None,
+                        renderer=renderer, **solver_args)
+        solver.solve()
+
+
+        level.dump(renderer=renderer)
+        print("File:", name)
+        print("Done:", level.done())
+        print("Time:", time.time() - start)
+        if solver.cached is not None:
+            print("Replayed a solve that took:", solver.cached["time"])
+        if arguments["--stats"]:
+            print(solver.stats)
+            if cache is not None:
+                print(cache)
 
         if not level.done():
             sys.exit(1)
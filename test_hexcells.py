@@ -0,0 +1,427 @@
+import itertools
+import os
+import random
+import time
+
+import pytest
+
+import hexcells
+from hexcells import BLACK, BLUE, EMPTY, UNKNOWN
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeLevel(object):
+    """ just enough of a Level for the pattern functions, the colors of some cells """
+    def __init__(self, colors):
+        self.colors = colors
+
+    def get_color(self, c):
+        return self.colors[c]
+
+
+def random_line(rng, size):
+    """ (cells, count, level) for a line of size cells with a random solution, some of it revealed """
+    cells = [(i, 0) for i in range(size)]
+    rng.shuffle(cells)
+    truth = [rng.choice([BLUE, BLACK, EMPTY]) for _ in cells]
+    count = truth.count(BLUE)
+    colors = [x if x == EMPTY or rng.random() < 0.3 else UNKNOWN for x in truth]
+    return cells, count, FakeLevel(dict(zip(cells, colors)))
+
+
+def test_modifier_patterns_match_eval_modifier():
+    rng = random.Random(1)
+    for wrap in (False, True):
+        for _ in range(3000):
+            cells, count, level = random_line(rng, rng.randint(1, 9))
+            for together, is_valid in [(True, hexcells.is_joint), (False, hexcells.is_disjoint)]:
+                indicies, patterns = hexcells.eval_modifier(cells, count, is_valid, wrap, level)
+                try:
+                    indicies2, patterns2 = hexcells.modifier_patterns(cells, count, together, wrap, level)
+                except hexcells.Contradiction:
+                    assert not patterns
+                    continue
+                assert list(indicies) == list(indicies2)
+                assert set(patterns) == set(patterns2)
+                assert len(set(patterns2)) == len(patterns2)
+
+
+def read_level(name):
+    with open(os.path.join(HERE, "solved", name + ".hexcells"), "rb") as f:
+        return hexcells.Level(f.read().decode("utf-8"))
+
+
+def solved_names():
+    return sorted(name[:-len(".hexcells")] for name in os.listdir(os.path.join(HERE, "solved")))
+
+
+def test_numpy_backend(monkeypatch):
+    pytest.importorskip("numpy")
+    hexcells.load_numpy()
+    solver = hexcells.Solver(read_level("darman-tutorial_12"))
+    assert solver.solve()
+    monkeypatch.setattr(hexcells, "NUMPY", True)
+    arrays = hexcells.Solver(read_level("darman-tutorial_12"))
+    assert arrays.solve()
+    assert arrays.history == solver.history
+
+
+def brute_force(nvars, clauses, assumptions=()):
+    """ whether the clauses have a model with the assumptions true, trying every assignment """
+    for bits in itertools.product([False, True], repeat=nvars):
+        value = lambda x: bits[abs(x) - 1] == (x > 0)
+        if all(value(x) for x in assumptions) and all(any(value(x) for x in clause) for clause in clauses):
+            return True
+    return False
+
+
+def test_sat_solver_against_brute_force():
+    rng = random.Random(2)
+    for _ in range(300):
+        cnf = hexcells.CNF()
+        nvars = rng.randint(1, 10)
+        for _ in range(nvars):
+            cnf.var()
+        for _ in range(rng.randint(0, 4 * nvars)):
+            cnf.add([rng.choice([-1, 1]) * rng.randint(1, nvars) for _ in range(rng.randint(1, 3))])
+        sat = hexcells.SatSolver(cnf)
+        # the same solver for every question, so the clauses it learns carry over
+        for _ in range(10):
+            assumptions = [rng.choice([-1, 1]) * v for v in rng.sample(range(1, nvars + 1), rng.randint(0, min(3, nvars)))]
+            model = sat.solve(assumptions)
+            assert (model is not None) == brute_force(nvars, cnf.clauses, assumptions)
+            if model is not None:
+                value = lambda x: model[abs(x)] == (x > 0)
+                assert all(value(x) for x in assumptions)
+                assert all(any(value(x) for x in clause) for clause in cnf.clauses)
+
+
+def test_component_moves_against_brute_force():
+    rng = random.Random(5)
+    checked = 0
+    for _ in range(200):
+        level = hexcells.Level.from_lines(["Hexcells level v1", "", "", "", ""] + hexcells.random_board(hexcells.hexagon(2), rng))
+        shape = [c for c in level.all_cells() if level.get_color(c) == UNKNOWN]
+        for c in rng.sample(shape, rng.randint(5, 10)):
+            level.play(c, BLUE if level.cell(c).true_value else BLACK)
+        unknown = [c for c in level.all_cells() if level.get_color(c) == UNKNOWN]
+        constraints = hexcells.level_constraints(level)
+        remaining = level.total_count() - sum(1 for c in level.all_cells() if level.get_color(c) == BLUE)
+        # every coloring of the unknown cells consistent with the constraints and the blue count
+        solutions = []
+        for bits in itertools.product([0, 1], repeat=len(unknown)):
+            if sum(bits) != remaining:
+                continue
+            value = dict(zip(unknown, bits))
+            for _, cells, min_count, max_count, patterns in constraints:
+                values = tuple(value[c] for c in cells)
+                if patterns is not None and values not in patterns:
+                    break
+                if patterns is None and not min_count <= sum(values) <= max_count:
+                    break
+            else:
+                solutions.append(value)
+        forced = set()
+        for c in unknown:
+            values = {solution[c] for solution in solutions}
+            if len(values) == 1:
+                forced.add((c, BLUE if values.pop() else BLACK))
+        moves, _ = hexcells.component_moves(level)
+        assert moves == forced
+        checked += bool(forced)
+    assert checked > 50
+
+
+def test_cnf_count():
+    for n in range(6):
+        for min_count in range(-1, n + 2):
+            for max_count in range(min_count, n + 2):
+                cnf = hexcells.CNF()
+                lits = [cnf.var() for _ in range(n)]
+                cnf.count(lits, min_count, max_count)
+                sat = hexcells.SatSolver(cnf)
+                for bits in itertools.product([False, True], repeat=n):
+                    assumptions = [x if bit else -x for x, bit in zip(lits, bits)]
+                    assert (sat.solve(assumptions) is not None) == (min_count <= sum(bits) <= max_count)
+
+
+def test_check_raises_on_unproven_moves():
+    level = read_level("cookie-so_tiny")
+    c = next(c for c in hexcells.GRID if level.get_color(c) == UNKNOWN)
+    solver = hexcells.Solver(level, check=True)
+    with pytest.raises(hexcells.UnprovenMoves):
+        solver.sat_check({(c, BLACK if level.cell(c).true_value else BLUE)}, None)
+    assert solver.solve()
+
+
+def test_results_only_keep_complete_solves(tmpdir):
+    results = hexcells.ResultCache(str(tmpdir.join("results.db")))
+    assert not hexcells.Solver(read_level("cookie-teamwork"), results=results).solve(limit=2)
+    solver = hexcells.Solver(read_level("cookie-teamwork"), results=results)
+    assert solver.solve()
+    assert solver.cached is None
+    solver = hexcells.Solver(read_level("cookie-teamwork"), results=results)
+    assert solver.solve()
+    assert solver.cached is not None
+
+
+def test_cancel_before_the_first_batch():
+    solver = hexcells.Solver(read_level("cookie-teamwork"))
+    batches = solver.moves()
+    solver.cancel()
+    assert list(batches) == []
+    assert not solver.level.done()
+
+
+def test_moves_keep_to_the_time_budget():
+    # big random boards take the constraint arithmetic minutes a pass
+    for seed in range(4):
+        rng = random.Random(seed)
+        level = hexcells.Level.from_lines(["Hexcells level v1", "", "", "", ""] + hexcells.random_board(hexcells.hexagon(6), rng))
+        start = time.time()
+        for _ in hexcells.Solver(level).moves(timeout=0.5):
+            pass
+        assert time.time() - start < 2
+
+
+def test_lazy_patterns_match_listing(monkeypatch):
+    rng = random.Random(3)
+    checked = 0
+    for _ in range(3000):
+        cells, count, level = random_line(rng, rng.randint(4, 12))
+        wrap = rng.random() < 0.5
+        monkeypatch.setattr(hexcells, "PATTERN_LIMIT", 10 ** 9)
+        try:
+            indicies, patterns = hexcells.modifier_patterns(cells, count, False, wrap, level)
+        except hexcells.Contradiction:
+            continue
+        monkeypatch.setattr(hexcells, "PATTERN_LIMIT", 0)
+        indicies2, lazy = hexcells.modifier_patterns(cells, count, False, wrap, level)
+        if not isinstance(lazy, hexcells.LazyPatterns):
+            continue
+        assert list(indicies) == list(indicies2)
+        assert set(patterns) == set(lazy) and len(lazy) == len(patterns)
+        forced = set()
+        for c, values in zip(indicies, hexcells.transpose(patterns)):
+            if len(set(values)) == 1:
+                forced.add((c, values[0]))
+        assert set(lazy.forced) == forced
+        checked += 1
+    assert checked > 1000
+
+
+def test_lazy_lines_deduce_as_much(monkeypatch):
+    solver = hexcells.Solver(read_level("darman-tutorial_12"))
+    assert solver.solve()
+    # every APART line lazy
+    monkeypatch.setattr(hexcells, "PATTERN_LIMIT", 0)
+    lazy = hexcells.Solver(read_level("darman-tutorial_12"))
+    assert lazy.solve()
+    assert lazy.stats.moves == solver.stats.moves
+
+
+def test_hexagon_has_to_fit_the_grid():
+    assert len(hexcells.hexagon(8)) == 217
+    with pytest.raises(ValueError):
+        hexcells.hexagon(9)
+
+
+@pytest.mark.parametrize("radius", [3, 5])
+def test_generated_levels_are_deducible(radius):
+    rng = random.Random(4)
+    for _ in range(5):
+        level = hexcells.generate(hexcells.hexagon(radius), rng, exhaustive=True, stall_pairs=0)
+        level = hexcells.Level(level.text())
+        # as --exhaustive solves it
+        assert hexcells.deducible(level, exhaustive=True)
+
+
+def test_generate_rejects_what_a_fresh_solver_cant_finish(monkeypatch):
+    monkeypatch.setattr(hexcells, "deducible", lambda level, timeout=None, **solver_args: False)
+    assert hexcells.generate(hexcells.hexagon(2), random.Random(4), exhaustive=True, stall_pairs=0) is None
+
+
+def test_generate_command(tmpdir):
+    import subprocess
+    import sys
+    fname = str(tmpdir.join("generated.hexcells"))
+    subprocess.check_call([sys.executable, os.path.join(HERE, "hexcells.py"), "generate", "--seed=1", "--count=3", fname])
+    levels = [level for _, level in hexcells.read_levels([fname])]
+    assert len(levels) == 3
+    shape = set(hexcells.hexagon(4))
+    for level in levels:
+        assert level.title == "Generated"
+        assert {c for c in hexcells.GRID if level.get_color(c) != hexcells.EMPTY} == shape
+        assert hexcells.deducible(level, exhaustive=True)
+
+
+@pytest.mark.parametrize("options", [
+    dict(incremental=True),
+    dict(scheduled=True),
+    dict(scheduled=True, incremental=True),
+    dict(batched=True),
+    dict(batched=True, incremental=True),
+    dict(batched=True, scheduled=True),
+    dict(prune=True),
+    dict(prune=True, scheduled=True),
+    dict(max_constraints=75),
+    dict(max_constraints=75, incremental=True),
+    dict(max_constraints=75, prune=True),
+])
+def test_modes_solve_the_same(options):
+    for name in solved_names():
+        level = read_level(name)
+        assert hexcells.Solver(level, **options).solve(), name
+        expected = read_level(name)
+        for c in expected.all_cells():
+            if expected.get_color(c) == UNKNOWN:
+                expected.play(c, BLUE if expected.cell(c).true_value else BLACK)
+        assert level.digest() == expected.digest(), name
+
+
+def test_benchmark_ignores_noise_on_tiny_levels(monkeypatch):
+    levels = [("cookie-so_tiny", read_level("cookie-so_tiny"))]
+    baseline = {"cookie-so_tiny": {"solved": True, "time": 1e-6}}
+    results, regressed = hexcells.benchmark(levels, 0, 1, baseline=baseline)
+    assert results["cookie-so_tiny"]["solved"] and not regressed
+    monkeypatch.setattr(hexcells, "BENCHMARK_NOISE", 0)
+    assert hexcells.benchmark(levels, 0, 1, baseline=baseline)[1]
+
+
+def test_cache_keeps_the_history():
+    solver = hexcells.Solver(read_level("darman-tutorial_12"))
+    assert solver.solve()
+    cache = hexcells.DerivationCache(100000)
+    for _ in range(2):
+        # the second solve takes everything it can from the cache
+        cached = hexcells.Solver(read_level("darman-tutorial_12"), cache=cache)
+        assert cached.solve()
+        assert cached.history == solver.history
+    assert cache.hits > cache.misses
+
+
+def test_pair_jobs_keep_the_history():
+    solver = hexcells.Solver(read_level("darman-tutorial_12"))
+    assert solver.solve()
+    # chunks small enough that most passes go to the pool
+    pooled = hexcells.Solver(read_level("darman-tutorial_12"), pair_jobs=2, pair_chunk=50)
+    assert pooled.solve()
+    assert pooled.history == solver.history
+
+
+@pytest.mark.parametrize("plain", [False, True])
+def test_renderer_frames_match_a_fresh_render(plain):
+    level = read_level("cookie-teamwork")
+    renderer = hexcells.Renderer(plain=plain)
+    frames = 0
+    for moves, cs in hexcells.Solver(level).moves():
+        blues = [c for c, _ in moves]
+        for reds, blues in [(cs.bases, blues), (None, None)]:
+            assert renderer.render(level, reds, blues) == hexcells.Renderer(plain=plain).render(level, reds, blues)
+            frames += 1
+    assert frames > 10
+
+
+def test_archive_round_trip(tmpdir):
+    names = solved_names()
+    fname = str(tmpdir.join("solved.hxb"))
+    with open(fname, "wb") as f:
+        assert hexcells.write_archive((read_level(name) for name in names), f) == len(names)
+    levels = list(hexcells.read_levels([fname]))
+    assert len(levels) == len(names)
+    for name, (_, level) in zip(names, levels):
+        expected = read_level(name)
+        assert level.text() == expected.text()
+        assert level.title == expected.title
+    archive = hexcells.LevelArchive(fname)
+    with pytest.raises(IndexError):
+        archive[len(names)]
+    archive.close()
+
+
+def test_probe_leaves_the_level_as_it_was():
+    level = read_level("cookie-teamwork")
+    text, digest = level.text(), level.digest()
+    contradictions = 0
+    for _, cells, _, _, _ in hexcells.level_constraints(level):
+        for c in cells:
+            for color in (BLUE, BLACK):
+                contradictions += hexcells.probe(level, c, color, depth=5)
+                assert level.text() == text and level.digest() == digest
+    assert contradictions
+
+
+def test_overfull_apart_line_is_a_contradiction():
+    # what a wrong assumption leaves behind while probing
+    cells = [(i, 0) for i in range(5)]
+    level = FakeLevel(dict(zip(cells, [BLUE, BLACK, BLUE, BLUE, UNKNOWN])))
+    with pytest.raises(hexcells.Contradiction):
+        hexcells.modifier_patterns(cells, 2, False, False, level)
+
+
+def test_probed_moves_are_right():
+    probed = 0
+    for name in solved_names():
+        level = read_level(name)
+        for i, _ in enumerate(hexcells.Solver(level).moves()):
+            if i % 20:
+                continue
+            moves, _ = hexcells.Solver(level, probe=True).probe_search()
+            for c, color in moves or ():
+                assert level.cell(c).true_value == (color == BLUE), name
+                probed += 1
+    assert probed > 10
+
+
+def test_popcount():
+    rng = random.Random(6)
+    for _ in range(1000):
+        mask = rng.getrandbits(1089) & rng.getrandbits(1089) & rng.getrandbits(1089)
+        assert hexcells.popcount(mask) == bin(mask).count("1")
+
+
+def test_piped_boards_have_no_colors():
+    import subprocess
+    import sys
+    out = subprocess.check_output([sys.executable, os.path.join(HERE, "hexcells.py"), "--show-moves",
+                                   os.path.join(HERE, "solved", "cookie-so_tiny.hexcells")])
+    assert b"X." in out and b"\x1b[" not in out
+
+
+def test_listing_lazy_lines_past_max_constraints(monkeypatch):
+    monkeypatch.setattr(hexcells, "PATTERN_LIMIT", 0)
+    solver = hexcells.Solver(read_level("pteranodonc-1_2_buckle_my_shoe"), batched=True)
+    solver.evaluate()
+    lazy = [cs for cs in solver.all_constraints.values() if cs.lazy is not None]
+    assert len(lazy) > 1
+    # as derived lazy lines, which evict may drop while the others are listed
+    for cs in lazy:
+        solver.all_constraints[cs.cells] = cs.rebased(cs.bases | {"derived"}, cs.debug)
+    solver.max_constraints = len(solver.all_constraints) - 1
+    assert solver.list_lazy()
+    assert all(cs.lazy is None for cs in solver.all_constraints.values())
+
+
+@pytest.mark.parametrize("options", [
+    dict(),
+    dict(incremental=True),
+    dict(scheduled=True),
+    dict(batched=True),
+    dict(prune=True, max_constraints=75),
+])
+def test_uninformative_constraints_are_never_stored(options):
+    for name in solved_names():
+        solver = hexcells.Solver(read_level(name), **options)
+        for _ in solver.moves():
+            assert all(cs.interesting for cs in solver.all_constraints.values()), name
+
+
+def test_add_constraint_drops_uninformative_ones():
+    solver = hexcells.Solver(read_level("cookie-so_tiny"))
+    solver.evaluate()
+    cells = [c for c in hexcells.GRID if solver.level.get_color(c) == UNKNOWN][:3]
+    cs = hexcells.Constraint({"test"}, hexcells.cells_mask(cells), 0, len(cells), "test")
+    assert cs.size == 3 and not cs.interesting
+    assert solver.add_constraint(cs) == (None, None)
+    assert cs.cells not in solver.all_constraints